@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bigdata_app.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +84,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Holds the per-user recommendation queues; the local-memory backend evicts the least recently used entries
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recommendations',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -126,3 +143,18 @@ STATICFILES_DIRS = ('static',)
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Instrumentation of the requests (bigdata_app.middleware.InstrumentationMiddleware):
+# requests slower than RECOMMENDER_SLOW_REQUEST_MS are logged, and a share of the requests
+# given by RECOMMENDER_PROFILE_SAMPLE_RATE is profiled, the slow ones being dumped to RECOMMENDER_PROFILE_DIR
+RECOMMENDER_SLOW_REQUEST_MS = 500
+RECOMMENDER_PROFILE_SAMPLE_RATE = 0
+RECOMMENDER_PROFILE_DIR = BASE_DIR / 'bigdata_app' / 'data' / 'profiles'
+
+# /metrics is served to the staff, to a scraper sending METRICS_TOKEN as a bearer token, and to the
+# addresses of METRICS_ALLOWED_IPS (comma separated); behind a reverse proxy, do not list its address
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Bearer token of the services calling /api/recommendations for any user, logged in users only get their own
+RECOMMENDATIONS_API_TOKEN = os.environ.get('RECOMMENDATIONS_API_TOKEN')
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import Impression, IngestionJob, Photo, UserPreference
+
+admin.site.register(Photo)
+admin.site.register(UserPreference)
+admin.site.register(Impression)
+admin.site.register(IngestionJob)
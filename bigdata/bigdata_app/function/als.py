@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .instrumentation import timed
+
+# Implicit-feedback matrix factorization (Hu, Koren and Volinsky) trained by alternating least squares
+# on the binary like matrix. Every like has a confidence of 1 + alpha, every other cell a confidence of 1.
+
+als_file = './bigdata_app/data/als.npz'
+
+# Cache for the model of this process, and the folded-in vectors of the most recently served users,
+# keyed by their number of likes; the least recently used ones are dropped past `max_cached_users`
+model_cache = None
+user_vector_cache = OrderedDict()
+user_vector_lock = threading.Lock()
+max_cached_users = 10000
+
+
+def _solve_rows(matrix, fixed, regularization, alpha, max_nnz=8192):
+    # Least squares solution of every row of `matrix` against the fixed factors:
+    # (YtY + alpha * Yu^T Yu + reg * I) x_u = (1 + alpha) * Yu^T 1, solved by batches of rows
+    num_factors = fixed.shape[1]
+    base = fixed.T @ fixed + regularization * np.eye(num_factors, dtype=np.float32)
+    result = np.zeros((matrix.shape[0], num_factors), dtype=np.float32)
+    counts = np.diff(matrix.indptr)
+
+    start = 0
+    while start < matrix.shape[0]:
+        # As many rows as fit in `max_nnz` outer products, at least one
+        stop = max(int(np.searchsorted(matrix.indptr, matrix.indptr[start] + max_nnz, side='right')) - 1, start + 1)
+        stop = min(stop, matrix.shape[0])
+        rows = np.flatnonzero(counts[start:stop]) + start
+        if len(rows):
+            chunk = matrix[rows]
+            vectors = fixed[chunk.indices]
+            outer = vectors[:, :, np.newaxis] * vectors[:, np.newaxis, :]
+            grams = np.add.reduceat(outer, chunk.indptr[:-1], axis=0)
+            rhs = (1 + alpha) * np.add.reduceat(vectors, chunk.indptr[:-1], axis=0)
+            result[rows] = np.linalg.solve(base + alpha * grams, rhs[:, :, np.newaxis])[:, :, 0]
+        start = stop
+    return result
+
+
+@timed('als.train')
+def train_als(user_image_matrix, factors=64, regularization=0.1, alpha=40.0, iterations=15, seed=0):
+    rng = np.random.default_rng(seed)
+    user_image_matrix = user_image_matrix.tocsr().astype(np.float32)
+    image_user_matrix = user_image_matrix.T.tocsr()
+    user_factors = np.zeros((user_image_matrix.shape[0], factors), dtype=np.float32)
+    item_factors = (0.01 * rng.standard_normal((user_image_matrix.shape[1], factors))).astype(np.float32)
+
+    for _ in range(iterations):
+        user_factors = _solve_rows(user_image_matrix, item_factors, regularization, alpha)
+        item_factors = _solve_rows(image_user_matrix, user_factors, regularization, alpha)
+    return user_factors, item_factors
+
+
+def save_als(path, user_factors, item_factors, user_ids, image_ids, user_like_counts, regularization, alpha):
+    # The number of likes of every user tells whether the trained vector is still up to date
+    np.savez(path + '.tmp.npz', user_factors=user_factors.astype(np.float32), item_factors=item_factors.astype(np.float32),
+             user_ids=np.asarray(user_ids, dtype=np.int64), image_ids=np.asarray(image_ids, dtype=str),
+             user_like_counts=np.asarray(user_like_counts, dtype=np.int32), regularization=regularization, alpha=alpha)
+    os.replace(path + '.tmp.npz', path)
+
+
+def load_als(path=als_file):
+    # Reloaded when the training command writes a new model
+    global model_cache
+    if not os.path.exists(path):
+        return None
+    mtime_ns = os.stat(path).st_mtime_ns
+    if model_cache is None or model_cache['mtime_ns'] != mtime_ns:
+        with np.load(path) as data:
+            model = {key: data[key] for key in data.files}
+        item_factors = model['item_factors']
+        model.update({
+            'mtime_ns': mtime_ns,
+            'user_positions': {user_id: i for i, user_id in enumerate(model['user_ids'].tolist())},
+            'image_positions': {image_id: i for i, image_id in enumerate(model['image_ids'].tolist())},
+            # Shared by every fold-in
+            'gram': item_factors.T @ item_factors + float(model['regularization']) * np.eye(item_factors.shape[1], dtype=np.float32),
+        })
+        model_cache = model
+        with user_vector_lock:
+            user_vector_cache.clear()
+    return model_cache
+
+
+def fold_in(model, liked_positions):
+    # Closed-form user vector for the liked items, the item factors staying fixed
+    vectors = model['item_factors'][liked_positions]
+    alpha = float(model['alpha'])
+    a = model['gram'] + alpha * (vectors.T @ vectors)
+    b = (1 + alpha) * vectors.sum(axis=0)
+    return np.linalg.solve(a, b).astype(np.float32)
+
+
+def user_vector(model, user_id, liked_image_ids):
+    # Trained vector while the user did not like anything since the training, else folded in
+    # again, at most once for each number of likes
+    with user_vector_lock:
+        cached = user_vector_cache.get(user_id)
+        if cached is not None and cached[0] == len(liked_image_ids):
+            user_vector_cache.move_to_end(user_id)
+            return cached[1]
+
+    liked_positions = [model['image_positions'][image_id] for image_id in liked_image_ids if image_id in model['image_positions']]
+    row = model['user_positions'].get(user_id)
+    if not liked_positions:
+        vector = None
+    elif row is not None and len(liked_positions) == len(liked_image_ids) and model['user_like_counts'][row] == len(liked_image_ids):
+        vector = model['user_factors'][row]
+    else:
+        vector = fold_in(model, liked_positions)
+    with user_vector_lock:
+        user_vector_cache[user_id] = (len(liked_image_ids), vector)
+        user_vector_cache.move_to_end(user_id)
+        while len(user_vector_cache) > max_cached_users:
+            user_vector_cache.popitem(last=False)
+    return vector
+
+
+def als_scores(model, vector):
+    # One matrix-vector product over the catalogue of the model
+    return model['item_factors'] @ vector
+
+
+def train_and_save(matrix, path=als_file, factors=64, regularization=0.1, alpha=40.0, iterations=15):
+    start = time.perf_counter()
+    user_image_matrix = matrix.csr()
+    user_factors, item_factors = train_als(user_image_matrix, factors, regularization, alpha, iterations)
+    save_als(path, user_factors, item_factors, matrix.user_ids[:user_image_matrix.shape[0]],
+             matrix.image_ids[:user_image_matrix.shape[1]], np.diff(user_image_matrix.indptr), regularization, alpha)
+    print(f"ALS model with {factors} factors trained on {user_image_matrix.shape[0]} users and "
+          f"{user_image_matrix.shape[1]} images in {time.perf_counter() - start:.1f}s, saved to {path}")
+    return user_factors, item_factors
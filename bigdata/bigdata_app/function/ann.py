@@ -0,0 +1,213 @@
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, issparse, vstack
+
+
+def _as_query(vector):
+    # Queries are dense 1-D float32 vectors, even when the indexed vectors are sparse
+    if issparse(vector):
+        vector = vector.toarray()
+    return np.asarray(vector, dtype=np.float32).ravel()
+
+
+def _dense(matrix):
+    return np.asarray(matrix.toarray() if issparse(matrix) else matrix, dtype=np.float32)
+
+
+def _dot(vectors, query):
+    return np.asarray(vectors @ query, dtype=np.float32).ravel()
+
+
+def _stack(vectors, new_vectors):
+    if vectors is None:
+        return new_vectors
+    if issparse(vectors):
+        return vstack([vectors, csr_matrix(new_vectors)]).tocsr()
+    return np.vstack([vectors, np.asarray(new_vectors, dtype=np.float32)])
+
+
+def _top_k(ids, scores, k):
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return ids[top], scores[top]
+
+
+# Exact maximum inner product search, the reference for the approximate indexes.
+# Vectors are rows of a dense array or of a CSR matrix; normalize them for cosine similarity.
+class BruteForceIndex:
+    kind = 'brute'
+
+    def __init__(self):
+        self.vectors = None
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, vectors, ids=None):
+        self.vectors = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        return self.add(vectors, ids)
+
+    def add(self, vectors, ids=None):
+        vectors = vectors.tocsr().astype(np.float32) if issparse(vectors) else np.asarray(vectors, dtype=np.float32)
+        if ids is None:
+            ids = np.arange(len(self.ids), len(self.ids) + vectors.shape[0])
+        self.vectors = _stack(self.vectors, vectors)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        return self
+
+    def query(self, vector, k=10):
+        return _top_k(self.ids, _dot(self.vectors, _as_query(vector)), k)
+
+    def _state(self):
+        state = {'kind': self.kind, 'ids': self.ids}
+        if issparse(self.vectors):
+            state.update(sparse=True, data=self.vectors.data, indices=self.vectors.indices,
+                         indptr=self.vectors.indptr, shape=self.vectors.shape)
+        else:
+            state.update(sparse=False, vectors=self.vectors)
+        return state
+
+    def _load_state(self, data):
+        self.ids = data['ids']
+        if bool(data['sparse']):
+            self.vectors = csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+        else:
+            self.vectors = data['vectors']
+
+    def save(self, path):
+        np.savez(path, **self._state())
+
+    @classmethod
+    def load(cls, path):
+        index = cls.__new__(cls)
+        BruteForceIndex.__init__(index)
+        with np.load(path) as data:
+            index._load_state(data)
+        return index
+
+
+# Inverted file index: the vectors are clustered with spherical k-means and a query
+# only scores the vectors of the `nprobe` clusters closest to it
+class IVFIndex(BruteForceIndex):
+    kind = 'ivf'
+
+    def __init__(self, nlist=64, nprobe=8, n_iter=10, sample_size=50000, seed=0):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+
+    def _train(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        num_vectors = vectors.shape[0]
+        nlist = max(1, min(self.nlist, num_vectors))
+        sample = vectors[rng.choice(num_vectors, min(num_vectors, self.sample_size), replace=False)]
+
+        centroids = _dense(sample[rng.choice(sample.shape[0], nlist, replace=False)])
+        for _ in range(self.n_iter):
+            assignments = np.asarray(sample @ centroids.T).argmax(axis=1)
+            one_hot = csr_matrix((np.ones(len(assignments), dtype=np.float32), (assignments, np.arange(len(assignments)))),
+                                 shape=(nlist, sample.shape[0]))
+            centroids = _dense(one_hot @ sample)
+
+            # Re-seed the empty clusters with random vectors of the sample
+            empty = np.flatnonzero(np.diff(one_hot.indptr) == 0)
+            if len(empty):
+                centroids[empty] = _dense(sample[rng.choice(sample.shape[0], len(empty), replace=False)])
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        self.centroids = centroids
+
+    def _assign(self, vectors):
+        return np.asarray(vectors @ self.centroids.T).argmax(axis=1).astype(np.int32)
+
+    def _build_lists(self):
+        # Vector positions grouped by cluster, with the offset of each cluster
+        self.order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(len(self.centroids) + 1))
+
+    def build(self, vectors, ids=None):
+        vectors = vectors.tocsr().astype(np.float32) if issparse(vectors) else np.asarray(vectors, dtype=np.float32)
+        self._train(vectors)
+        self.assignments = np.zeros(0, dtype=np.int32)
+        return super().build(vectors, ids)
+
+    def add(self, vectors, ids=None):
+        if self.centroids is None:
+            return self.build(vectors, ids)
+        super().add(vectors, ids)
+        self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+        self._build_lists()
+        return self
+
+    def query(self, vector, k=10, nprobe=None):
+        query = _as_query(vector)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+        return _top_k(self.ids[candidates], _dot(self.vectors[candidates], query), k)
+
+    def _state(self):
+        state = super()._state()
+        state.update(centroids=self.centroids, assignments=self.assignments, nlist=self.nlist, nprobe=self.nprobe)
+        return state
+
+    def _load_state(self, data):
+        super()._load_state(data)
+        self.centroids = data['centroids']
+        self.assignments = data['assignments']
+        self.nlist = int(data['nlist'])
+        self.nprobe = int(data['nprobe'])
+        self._build_lists()
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index._load_state(data)
+        return index
+
+
+index_types = {'brute': BruteForceIndex, 'ivf': IVFIndex}
+
+
+def load_index(path):
+    with np.load(path) as data:
+        kind = str(data['kind'])
+    return index_types[kind].load(path)
+
+
+def benchmark_index(index, vectors, queries, k=10, nprobes=(1, 2, 4, 8, 16)):
+    # Recall@k and latency of the index against the exact brute-force results
+    exact = BruteForceIndex().build(vectors)
+    results = []
+
+    start = time.perf_counter()
+    truth = [set(exact.query(q, k)[0].tolist()) for q in queries]
+    brute_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    results.append({'index': 'brute', 'nprobe': None, 'recall': 1.0, 'latency_ms': brute_ms})
+
+    for nprobe in nprobes if isinstance(index, IVFIndex) else (None,):
+        latencies, hits = [], 0
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids, _ = index.query(q, k, nprobe) if nprobe else index.query(q, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected.intersection(ids.tolist()))
+        results.append({
+            'index': index.kind,
+            'nprobe': nprobe,
+            'recall': hits / max(sum(len(t) for t in truth), 1),
+            'latency_ms': float(np.mean(latencies)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+        })
+    return results
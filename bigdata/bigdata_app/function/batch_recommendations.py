@@ -0,0 +1,119 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+from django.db.models import Max
+from ..models import UserPreference
+from .content_index import load_content_index
+from .bulk import load_bulk_context, score_block, top_positions, bulk_weights, chunk_size
+from .interactions import get_interaction_matrix
+from .instrumentation import timed
+
+recommendations_file = './bigdata_app/data/recommendations.npz'
+
+# Cache for the store read by the web process
+store_cache = None
+
+
+def _default_weights():
+    return {'content': 0.5, 'collaborative': 0.5}
+
+
+def _init_worker():
+    # With the spawn start method the worker starts from scratch and has to configure Django itself
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bigdata.settings')
+        django.setup()
+
+
+def score_users(user_ids, n=50, weights=None, metadata_file='./bigdata_app/data/metadata.npz'):
+    # Top-N catalogue positions of every user of a shard, padded with -1. The users are scored
+    # together by the matrix products of the bulk API, the liked and already shown images excluded
+    weights = bulk_weights('hybrid', weights or _default_weights())
+    context = load_bulk_context(metadata_file)
+    user_ids = [int(user_id) for user_id in user_ids]
+    results = np.full((len(user_ids), n), -1, dtype=np.int32)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        for row, (positions, _) in enumerate(top_positions(score_block(context, chunk, weights, exclude_seen=True), n), start):
+            results[row, :len(positions)] = positions
+    return results
+
+
+def load_recommendation_store(path=recommendations_file):
+    global store_cache
+    if not os.path.exists(path):
+        return None
+    mtime_ns = os.stat(path).st_mtime_ns
+    if store_cache is None or store_cache['mtime_ns'] != mtime_ns:
+        with np.load(path) as data:
+            store_cache = {key: data[key] for key in data.files}
+        store_cache['mtime_ns'] = mtime_ns
+    return store_cache
+
+
+@timed('recommend.precomputed')
+def get_precomputed_recommendations(user_id, path=recommendations_file):
+    # Ranked images of the last batch run, unless the user liked something since
+    store = load_recommendation_store(path)
+    if store is None:
+        return None
+    row = np.searchsorted(store['user_ids'], user_id)
+    if row >= len(store['user_ids']) or store['user_ids'][row] != user_id:
+        return None
+    last_like = UserPreference.objects.filter(user_id=user_id).aggregate(Max('id'))['id__max'] or 0
+    if last_like > int(store['last_preference_id']):
+        return None
+    items = store['items'][row]
+    return store['filenames'][items[items >= 0]].tolist()
+
+
+def compute_recommendations(n=50, workers=4, shard_size=256, changed_only=False, weights=None,
+                            metadata_file='./bigdata_app/data/metadata.npz', path=recommendations_file):
+    start = time.perf_counter()
+    last_preference_id = UserPreference.objects.aggregate(Max('id'))['id__max'] or 0
+    index = load_content_index(metadata_file)
+    get_interaction_matrix()
+
+    previous = load_recommendation_store(path)
+    same_catalogue = (previous is not None and previous['items'].shape[1] == n
+                      and np.array_equal(previous['filenames'], index['filenames']))
+
+    # Only the users who liked something since the last run, when the catalogue did not change
+    if changed_only and same_catalogue:
+        user_ids = UserPreference.objects.filter(id__gt=int(previous['last_preference_id']))
+    else:
+        user_ids = UserPreference.objects.all()
+    user_ids = np.array(sorted(set(user_ids.values_list('user_id', flat=True))), dtype=np.int64)
+
+    # Score the users by shards in a pool of processes, the catalogue and the likes being loaded
+    # before the pool starts so that forked workers inherit them
+    shards = [user_ids[i:i + shard_size] for i in range(0, len(user_ids), shard_size)]
+    connections.close_all()
+    if workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            results = list(executor.map(score_users, shards, [n] * len(shards), [weights] * len(shards),
+                                        [metadata_file] * len(shards)))
+    else:
+        results = [score_users(shard, n, weights, metadata_file) for shard in shards]
+    items = np.concatenate(results) if results else np.zeros((0, n), dtype=np.int32)
+
+    # Keep the rows of the users that were not recomputed
+    if changed_only and same_catalogue:
+        kept = ~np.isin(previous['user_ids'], user_ids)
+        user_ids = np.concatenate([previous['user_ids'][kept], user_ids])
+        items = np.concatenate([previous['items'][kept], items])
+        order = np.argsort(user_ids, kind='stable')
+        user_ids, items = user_ids[order], items[order]
+
+    np.savez(path + '.tmp.npz', user_ids=user_ids, items=items, filenames=index['filenames'],
+             last_preference_id=last_preference_id)
+    os.replace(path + '.tmp.npz', path)
+
+    elapsed = time.perf_counter() - start
+    print(f"Recommendations of {sum(len(shard) for shard in shards)} users computed in {elapsed:.1f}s, "
+          f"{len(user_ids)} users saved to {path}")
+    return len(user_ids)
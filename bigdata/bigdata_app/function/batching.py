@@ -0,0 +1,60 @@
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# PIL and exifread are only imported by the ingestion, the serving path imports this module through embeddings
+
+
+def load_image_array(image_path, target_size=(224, 224)):
+    from keras.utils import load_img, img_to_array
+    img = load_img(image_path, target_size=target_size)
+    return img_to_array(img)
+
+
+def load_image_and_exif(image_path, target_size=(224, 224)):
+    # Single read of the file: the EXIF tags are parsed from the buffer and the JPEG is
+    # decoded by the draft mode at a reduced scale close to the model size
+    import exifread
+    from PIL import Image
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    exif_tags = exifread.process_file(io.BytesIO(data), details=False, stop_tag='UNDEF')
+    img = Image.open(io.BytesIO(data))
+    img.draft('RGB', target_size)
+    img = img.convert('RGB').resize(target_size, Image.NEAREST)
+    return np.asarray(img, dtype=np.uint8), {str(tag): str(value) for tag, value in exif_tags.items() if tag != 'JPEGThumbnail'}
+
+
+def _load(loader, path):
+    try:
+        return loader(path), None
+    except Exception as e:
+        return None, e
+
+
+def iter_image_batches(paths, loader=load_image_array, batch_size=64, num_workers=4, prefetch=2):
+    # Decode the images in a thread pool while the caller runs the model on the previous batch.
+    # Only `prefetch` batches are in flight so that memory stays bounded on large catalogues.
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, [executor.submit(_load, loader, path) for path in batch]))
+            if len(pending) > prefetch:
+                yield _collect(*pending.popleft())
+        while pending:
+            yield _collect(*pending.popleft())
+
+
+def _collect(batch, futures):
+    # Split the batch into the loaded images and the failures
+    loaded, results, failures = [], [], []
+    for path, future in zip(batch, futures):
+        result, error = future.result()
+        if error is None:
+            loaded.append(path)
+            results.append(result)
+        else:
+            failures.append((path, error))
+    return loaded, results, failures
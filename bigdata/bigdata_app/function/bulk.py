@@ -0,0 +1,192 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from ..models import Impression
+from .content_index import load_content_index
+from .interactions import get_interaction_matrix
+from .hybrid import _catalogue_map
+from .als import load_als, user_vector
+from .instrumentation import timed
+
+# Recommendations of many users at once: the users of a chunk are scored together by sparse and
+# dense matrix products over the catalogue, instead of one call of the recommenders per user.
+
+# Largest number of users of one call, and of one chunk of the score matrix
+max_users = 1000
+chunk_size = 256
+
+bulk_algorithms = ('content', 'collaborative', 'als', 'hybrid')
+
+
+def _column_map(context):
+    # Sparse 0/1 matrix moving the columns of the like matrix to the catalogue order
+    mapping = context['matrix_map']
+    known = np.flatnonzero(mapping >= 0)
+    return csr_matrix((np.ones(len(known), dtype=np.float32), (known, mapping[known])),
+                      shape=(len(mapping), context['num_images']))
+
+
+def _neighbor_matrix(index):
+    # The top-K neighbor lists of the content index as a sparse image x image matrix, built once per index
+    if 'neighbor_matrix' not in index:
+        num_images, top_k = index['neighbors'].shape
+        index['neighbor_matrix'] = csr_matrix(
+            (index['scores'].ravel(), index['neighbors'].ravel(), np.arange(0, num_images * top_k + 1, top_k)),
+            shape=(num_images, num_images))
+    return index['neighbor_matrix']
+
+
+def content_block(context, rows, likes):
+    return np.asarray((likes @ _neighbor_matrix(context['index'])).todense(), dtype=np.float32)
+
+
+def collaborative_block(context, rows, likes, k=10):
+    # Cosine kNN of all the users of the chunk with one sparse product, then the votes of the neighbors
+    user_image_matrix = context['user_image_matrix']
+    num_users = user_image_matrix.shape[0]
+    k = min(k, num_users - 1)
+    known = np.flatnonzero(rows >= 0)
+    if k <= 0 or not len(known):
+        return np.zeros((len(rows), context['num_images']), dtype=np.float32)
+
+    norms = np.sqrt(np.diff(user_image_matrix.indptr)).astype(np.float32)
+    overlap = np.asarray((user_image_matrix[rows[known]] @ user_image_matrix.T).todense(), dtype=np.float32)
+    similarities = overlap / np.maximum(norms[rows[known], np.newaxis] * norms[np.newaxis, :], 1e-12)
+    similarities[np.arange(len(known)), rows[known]] = -np.inf
+    neighbors = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+
+    selection = csr_matrix((np.ones(neighbors.size, dtype=np.float32), neighbors.ravel(),
+                            np.arange(0, neighbors.size + 1, k)), shape=(len(known), num_users))
+    scores = np.zeros((len(rows), context['num_images']), dtype=np.float32)
+    scores[known] = (selection @ user_image_matrix @ context['column_map']).todense()
+    return scores
+
+
+def als_block(context, rows, likes):
+    # Stacked user vectors times the item factors, one dense product for the chunk
+    model = load_als()
+    scores = np.zeros((len(rows), context['num_images']), dtype=np.float32)
+    if model is None:
+        return scores
+    image_ids = context['matrix'].image_ids
+    user_image_matrix = context['user_image_matrix']
+    vectors = np.zeros((len(rows), model['item_factors'].shape[1]), dtype=np.float32)
+    for i, (user_id, row) in enumerate(zip(context['user_ids'], rows)):
+        if row >= 0:
+            liked = [image_ids[column] for column in user_image_matrix.indices[user_image_matrix.indptr[row]:user_image_matrix.indptr[row + 1]]]
+            vector = user_vector(model, int(user_id), liked)
+            if vector is not None:
+                vectors[i] = vector
+    model_map = _catalogue_map(('als', context['index']['signature'], model['mtime_ns']),
+                               context['index']['positions'], model['image_ids'].tolist())
+    known = model_map >= 0
+    scores[:, model_map[known]] = np.maximum(vectors @ model['item_factors'][known].T, 0)
+    return scores
+
+
+bulk_components = {
+    'content': content_block,
+    'collaborative': collaborative_block,
+    'als': als_block,
+}
+
+
+def _normalized(scores):
+    # Every row scaled to [0, 1] by its maximum, as in hybrid_scores
+    top = scores.max(axis=1, keepdims=True) if scores.shape[1] else np.zeros((len(scores), 1), dtype=np.float32)
+    return np.divide(scores, top, out=np.zeros_like(scores), where=top > 0)
+
+
+def load_bulk_context(metadata_file='./bigdata_app/data/metadata.npz'):
+    # Catalogue and like matrix shared by every chunk of users
+    index = load_content_index(metadata_file)
+    matrix = get_interaction_matrix()
+    user_image_matrix = matrix.csr()
+    context = {
+        'index': index,
+        'matrix': matrix,
+        'user_image_matrix': user_image_matrix,
+        'matrix_map': _catalogue_map(('matrix', index['signature']), index['positions'], matrix.image_ids),
+        'num_images': len(index['filenames']),
+    }
+    context['column_map'] = _column_map(context)
+    return context
+
+
+def _seen_matrix(context, user_ids):
+    # Images shown to the users of a chunk, in the catalogue order, read with one query
+    rows, columns = [], []
+    chunk_rows = {user_id: i for i, user_id in enumerate(user_ids)}
+    positions = context['index']['positions']
+    for user_id, image_id in Impression.objects.filter(user_id__in=list(chunk_rows)).values_list('user_id', 'image_id'):
+        position = positions.get(image_id)
+        if position is not None:
+            rows.append(chunk_rows[user_id])
+            columns.append(position)
+    return csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(user_ids), context['num_images']))
+
+
+def score_block(context, user_ids, weights, exclude_seen=False):
+    # Weighted scores of a chunk of users over the catalogue, the liked (and shown) images set to 0
+    user_image_matrix = context['user_image_matrix']
+    matrix = context['matrix']
+    rows = np.array([matrix.user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+    rows[rows >= user_image_matrix.shape[0]] = -1
+    context['user_ids'] = user_ids
+
+    # Likes of the chunk in the catalogue order, the users without likes having empty rows
+    likes = csr_matrix((len(user_ids), context['num_images']), dtype=np.float32)
+    known = np.flatnonzero(rows >= 0)
+    if len(known):
+        likes = csr_matrix((np.ones(len(known), dtype=np.float32), (known, rows[known])),
+                           shape=(len(user_ids), user_image_matrix.shape[0])) @ user_image_matrix @ context['column_map']
+
+    scores = np.zeros((len(user_ids), context['num_images']), dtype=np.float32)
+    for name, weight in weights.items():
+        if weight:
+            scores += weight * _normalized(bulk_components[name](context, rows, likes))
+
+    excluded_rows, excluded_columns = likes.nonzero()
+    scores[excluded_rows, excluded_columns] = 0
+    if exclude_seen:
+        excluded_rows, excluded_columns = _seen_matrix(context, user_ids).nonzero()
+        scores[excluded_rows, excluded_columns] = 0
+    return scores
+
+
+def top_positions(scores, n):
+    # (positions, scores) of the best n of every row with a positive score, without sorting the whole catalogue
+    count = min(n, scores.shape[1])
+    if count == 0:
+        return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(len(scores))]
+    top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+    return [(positions[values > 0], values[values > 0]) for positions, values in zip(top, top_scores)]
+
+
+def bulk_weights(algorithm='hybrid', weights=None):
+    if algorithm not in bulk_algorithms:
+        raise ValueError(f"Unknown algorithm {algorithm}, expected one of {', '.join(bulk_algorithms)}")
+    if algorithm != 'hybrid':
+        return {algorithm: 1}
+    weights = weights or {'content': 0.5, 'collaborative': 0.5}
+    unknown = [name for name, weight in weights.items() if weight and name not in bulk_components]
+    if unknown:
+        raise ValueError(f"No bulk scoring for {', '.join(unknown)}, expected among {', '.join(bulk_components)}")
+    return weights
+
+
+@timed('recommend.bulk')
+def bulk_recommendations(user_ids, n=10, algorithm='hybrid', weights=None, metadata_file='./bigdata_app/data/metadata.npz'):
+    # {user_id: [(filename, score), ...]} for every requested user, the liked images being excluded
+    weights = bulk_weights(algorithm, weights)
+    context = load_bulk_context(metadata_file)
+    filenames = context['index']['filenames']
+
+    results = {}
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        for user_id, (positions, values) in zip(chunk, top_positions(score_block(context, chunk, weights), n)):
+            results[user_id] = list(zip(filenames[positions].tolist(), values.tolist()))
+    return results
@@ -0,0 +1,155 @@
+import logging
+import os
+import numpy as np
+from scipy.sparse import save_npz, load_npz
+from .ann import IVFIndex, load_index
+from .metadata_store import resolve_metadata_file, load_metadata, compact_path
+from .instrumentation import timer, timed, increment
+
+index_dir = './bigdata_app/data/content_index/'
+
+logger = logging.getLogger(__name__)
+
+# Cache for the loaded index, keyed by the metadata file it was built from, reloaded when the index file changes
+index_cache = {}
+
+
+def _source_signature(metadata_file):
+    stat = os.stat(resolve_metadata_file(metadata_file))
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _chunk_rows(num_images, max_bytes):
+    # Rows of one chunk: every row costs a dense float32 row of similarities and the int64 indices of argpartition
+    return max(1, max_bytes // (12 * max(num_images, 1)))
+
+
+def _top_k_neighbors(image_vectors, top_k, max_bytes):
+    # Compute the top-K most similar images of every image, a chunk of rows at a time,
+    # so that the full N x N similarity matrix is never materialized
+    num_images = image_vectors.shape[0]
+    top_k = min(top_k, max(num_images - 1, 1))
+    chunk_size = _chunk_rows(num_images, max_bytes)
+    neighbors = np.zeros((num_images, top_k), dtype=np.int32)
+    scores = np.zeros((num_images, top_k), dtype=np.float32)
+
+    for start in range(0, num_images, chunk_size):
+        stop = min(start + chunk_size, num_images)
+        # Rows are L2-normalized by the TfidfVectorizer, so the dot product is the cosine similarity
+        similarities = (image_vectors[start:stop] @ image_vectors.T).toarray()
+        similarities[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        # The largest K are partitioned to the end of each row, without a negated copy of the chunk
+        top = np.argpartition(similarities, -top_k, axis=1)[:, -top_k:]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        neighbors[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.maximum(np.take_along_axis(top_scores, order, axis=1), 0)
+        del similarities, top
+
+    return neighbors, scores
+
+
+def _tmp_path(path):
+    # Unique to this process, so that the worker and a web process building at the same time never share a file
+    return f'{path}.{os.getpid()}.tmp.npz'
+
+
+@timed('content_index.build')
+def build_content_index(metadata_file, output_dir=index_dir, top_k=50, max_chunk_bytes=256 * 2 ** 20):
+    # scikit-learn is only needed to build the index, not to serve it
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    metadata = load_metadata(metadata_file)
+    filenames = metadata['filenames']
+
+    # Rebuild the tag text of each image from the tag ids
+    vocabulary = metadata['tag_vocabulary']
+    offsets = metadata['tag_offsets']
+    documents = (' '.join(vocabulary[metadata['tag_ids'][offsets[i]:offsets[i + 1]]]) for i in range(len(filenames)))
+
+    # Fit the TfidfVectorizer once and keep the sparse tag matrix
+    vectorizer = TfidfVectorizer()
+    image_vectors = vectorizer.fit_transform(documents).tocsr().astype(np.float32)
+    neighbors, scores = _top_k_neighbors(image_vectors, top_k, max_chunk_bytes)
+
+    mtime_ns, size = _source_signature(metadata_file)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # Write to temporary files first so that a concurrent reader never sees a partial index
+    vectors_file = os.path.join(output_dir, 'image_vectors.npz')
+    neighbors_file = os.path.join(output_dir, 'neighbors.npz')
+    vectors_tmp, neighbors_tmp = _tmp_path(vectors_file), _tmp_path(neighbors_file)
+    save_npz(vectors_tmp, image_vectors)
+    np.savez(neighbors_tmp, filenames=filenames, neighbors=neighbors, scores=scores,
+             source_mtime_ns=mtime_ns, source_size=size)
+    os.replace(vectors_tmp, vectors_file)
+    os.replace(neighbors_tmp, neighbors_file)
+
+    print(f"Content index built for {len(filenames)} images (top {neighbors.shape[1]} neighbors) in {output_dir}")
+
+
+def load_content_index(metadata_file, output_dir=index_dir):
+    # Serve the index last written by the ingestion or the build_content_index command, reloaded when
+    # it is rebuilt: a web request never fits the TF-IDF, even when the metadata file changed since
+    neighbors_file = os.path.join(output_dir, 'neighbors.npz')
+    vectors_file = os.path.join(output_dir, 'image_vectors.npz')
+    if not (os.path.exists(neighbors_file) and os.path.exists(vectors_file)):
+        raise FileNotFoundError(f'No content index in {output_dir}, run the ingestion or the build_content_index command')
+
+    mtime_ns = os.stat(neighbors_file).st_mtime_ns
+    index = index_cache.get(metadata_file)
+    if index is None or index['mtime_ns'] != mtime_ns:
+        increment('content_index.load')
+        with timer('content_index.load'), np.load(neighbors_file) as data:
+            filenames = data['filenames']
+            index = {
+                'mtime_ns': mtime_ns,
+                'signature': (int(data['source_mtime_ns']), int(data['source_size'])),
+                'filenames': filenames,
+                'positions': {filename: i for i, filename in enumerate(filenames.tolist())},
+                'neighbors': data['neighbors'],
+                'scores': data['scores'],
+                'image_vectors': load_npz(vectors_file).tocsr(),
+                'stale_logged': False,
+            }
+        index_cache[metadata_file] = index
+
+    # The store is only stat'ed here, a legacy metadata.json is converted by the next build
+    metadata_path = compact_path(metadata_file)
+    if not index['stale_logged'] and os.path.exists(metadata_path) and \
+            index['signature'] != (os.stat(metadata_path).st_mtime_ns, os.stat(metadata_path).st_size):
+        logger.warning('Content index in %s is older than %s, serving it until it is rebuilt', output_dir, metadata_file)
+        index['stale_logged'] = True
+    return index
+
+
+def content_scores(index, liked_positions):
+    # Sum the similarities of the neighbors of the liked images only
+    neighbors = index['neighbors'][liked_positions].ravel()
+    scores = index['scores'][liked_positions].ravel()
+    return np.bincount(neighbors, weights=scores, minlength=len(index['filenames']))
+
+
+def get_content_ann_index(index, output_dir=index_dir, nlist=64, nprobe=8):
+    # Approximate index over the TF-IDF vectors, saved next to the neighbor lists
+    if 'ann' in index:
+        return index['ann']
+
+    ann_file = os.path.join(output_dir, 'ann.npz')
+    neighbors_file = os.path.join(output_dir, 'neighbors.npz')
+    ann = None
+    if os.path.exists(ann_file) and os.stat(ann_file).st_mtime_ns >= os.stat(neighbors_file).st_mtime_ns:
+        ann = load_index(ann_file)
+        if len(ann) != len(index['filenames']):
+            ann = None
+    if ann is None:
+        ann = IVFIndex(nlist=nlist, nprobe=nprobe).build(index['image_vectors'])
+        ann_tmp = _tmp_path(ann_file)
+        ann.save(ann_tmp)
+        os.replace(ann_tmp, ann_file)
+
+    index['ann'] = ann
+    return ann
@@ -0,0 +1,93 @@
+import io
+import os
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+import tqdm
+
+# Status codes worth another attempt
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    pass
+
+
+def make_pool(concurrency, timeout=30):
+    # One connection pool shared by every worker thread: the connections are kept alive
+    # and reused across images instead of being opened for each download
+    return urllib3.PoolManager(
+        maxsize=concurrency,
+        block=True,
+        retries=False,
+        timeout=urllib3.Timeout(connect=10, read=timeout),
+        headers={'User-Agent': 'RecommendAI'},
+    )
+
+
+def _write_image(response, part_path, resize):
+    if resize is None:
+        # Stream the body to the temporary file
+        with open(part_path, 'wb') as f:
+            for chunk in response.stream(64 * 1024):
+                f.write(chunk)
+    else:
+        # Decode and resize the image before it reaches the disk
+        img = Image.open(io.BytesIO(response.read()))
+        img.draft('RGB', resize)
+        img = img.convert('RGB').resize(resize)
+        img.save(part_path, format='JPEG', quality=90)
+
+
+def fetch_image(http, image_url, image_path, retries=3, backoff=0.5, resize=None):
+    part_path = image_path + '.part'
+    for attempt in range(retries + 1):
+        try:
+            response = http.request('GET', image_url, preload_content=False)
+            try:
+                if response.status == 200:
+                    _write_image(response, part_path, resize)
+                    # Only a complete image is ever visible under its final name
+                    os.replace(part_path, image_path)
+                    return image_path
+                if response.status not in retry_statuses:
+                    raise DownloadError(f'HTTP {response.status} for {image_url}')
+                error = DownloadError(f'HTTP {response.status} for {image_url}')
+            finally:
+                response.release_conn()
+        except (urllib3.exceptions.HTTPError, OSError) as e:
+            error = e
+
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        if attempt < retries:
+            # Exponential backoff before the next attempt
+            time.sleep(backoff * 2 ** attempt)
+
+    raise DownloadError(f'Giving up on {image_url} after {retries + 1} attempts: {error}')
+
+
+def download_urls(jobs, concurrency=16, retries=3, backoff=0.5, resize=None, progress=None):
+    # Download (image_url, image_path) pairs with a bounded number of concurrent requests
+    http = make_pool(concurrency)
+    downloaded, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch_image, http, image_url, image_path, retries, backoff, resize): image_url
+                   for image_url, image_path in jobs}
+        try:
+            for future in tqdm.tqdm(as_completed(futures), total=len(futures), unit='img'):
+                try:
+                    future.result()
+                    downloaded += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to download image {futures[future]}: {str(e)}")
+                if progress is not None:
+                    progress(downloaded + failed, len(futures))
+        except BaseException:
+            # Cancelled by the caller: drop the downloads that did not start yet
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    http.clear()
+    return downloaded, failed
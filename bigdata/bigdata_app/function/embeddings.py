@@ -0,0 +1,146 @@
+import os
+import json
+import numpy as np
+from .batching import iter_image_batches
+from .instrumentation import timed
+
+embedding_dir = './bigdata_app/data/embeddings/'
+
+# Cache for the feature extractor and for the memory-mapped stores
+feature_model_cache = None
+store_cache = {}
+
+
+# Load and cache the EfficientNetB0 backbone without its classification head
+def load_feature_model():
+    global feature_model_cache
+    if feature_model_cache is None:
+        from keras.applications import EfficientNetB0
+        feature_model_cache = EfficientNetB0(weights='imagenet', include_top=False, pooling='avg')
+    return feature_model_cache
+
+
+def _load_sources(output_dir):
+    # Vectors, row of every image and (mtime_ns, size) of the file it was computed from, of the current store
+    vectors_file = os.path.join(output_dir, 'vectors.npy')
+    index_file = os.path.join(output_dir, 'index.json')
+    sources_file = os.path.join(output_dir, 'sources.json')
+    if not (os.path.exists(vectors_file) and os.path.exists(index_file) and os.path.exists(sources_file)):
+        return None, {}, {}
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    with open(sources_file, 'r') as f:
+        sources = {file: tuple(source) for file, source in json.load(f).items()}
+    return np.load(vectors_file, mmap_mode='r'), index, sources
+
+
+@timed('ingestion.embeddings')
+def build_embedding_store(input_dir, output_dir=embedding_dir, dtype='float32', batch_size=64, num_workers=4, progress=None):
+    # Check if the input directory exists
+    if not os.path.isdir(input_dir):
+        print(f'Input directory {input_dir} does not exist.')
+        return
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # List the images with their modification time and size
+    images = {}
+    for entry in os.scandir(input_dir):
+        if entry.name.endswith('.jpg') or entry.name.endswith('.jpeg') or entry.name.endswith('.png'):
+            stat = entry.stat()
+            images[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+    # The rows of the images that did not change since the last build are copied, only the others go through the model
+    existing, existing_index, sources = _load_sources(output_dir)
+    if existing is not None and existing.dtype != np.dtype(dtype):
+        existing, existing_index, sources = None, {}, {}
+    kept = sorted(file for file, source in images.items() if sources.get(file) == source and file in existing_index)
+    files = sorted(set(images) - set(kept))
+    if not files and len(kept) == len(existing_index):
+        print(f'Embeddings in {output_dir} are up to date.')
+        return
+
+    model = None
+    if files:
+        from keras.applications.efficientnet import preprocess_input
+        model = load_feature_model()
+    dimension = model.output_shape[-1] if model is not None else existing.shape[1]
+
+    # Write every pooled feature vector into one contiguous array on disk
+    vectors_file = os.path.join(output_dir, 'vectors.npy')
+    vectors_tmp = f'{vectors_file}.{os.getpid()}.tmp'
+    vectors = np.lib.format.open_memmap(vectors_tmp, mode='w+', dtype=dtype, shape=(len(kept) + len(files), dimension))
+    kept_rows = np.array([existing_index[file] for file in kept], dtype=np.int64)
+    for i in range(0, len(kept), 4096):
+        vectors[i:i + len(kept_rows[i:i + 4096])] = existing[kept_rows[i:i + 4096]]
+    index = {file: row for row, file in enumerate(kept)}
+    row = len(kept)
+
+    paths = [os.path.join(input_dir, file) for file in files]
+    done = 0
+    for loaded, batch, failures in iter_image_batches(paths, batch_size=batch_size, num_workers=num_workers):
+        for file_path, e in failures:
+            print(f"Failed to load {os.path.basename(file_path)}: {str(e)}")
+        if batch:
+            features = model.predict(preprocess_input(np.stack(batch)), batch_size=len(batch), verbose=0)
+            # Normalize the vectors so that a dot product is a cosine similarity
+            features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+            vectors[row:row + len(loaded)] = features
+            for file_path in loaded:
+                index[os.path.basename(file_path)] = row
+                row += 1
+        done += len(loaded) + len(failures)
+        if progress is not None:
+            progress(done, len(paths))
+
+    vectors.flush()
+    del vectors, existing
+
+    # Drop the rows of the images that could not be loaded
+    if row < len(kept) + len(files):
+        trimmed = np.load(vectors_tmp, mmap_mode='r')[:row]
+        np.save(vectors_tmp + '2', trimmed)
+        del trimmed
+        os.replace(vectors_tmp + '2.npy', vectors_tmp)
+
+    index_tmp = os.path.join(output_dir, f'index.json.{os.getpid()}.tmp')
+    sources_tmp = os.path.join(output_dir, f'sources.json.{os.getpid()}.tmp')
+    with open(index_tmp, 'w') as f:
+        json.dump(index, f)
+    with open(sources_tmp, 'w') as f:
+        json.dump({file: images[file] for file in index}, f)
+    os.replace(vectors_tmp, vectors_file)
+    os.replace(index_tmp, os.path.join(output_dir, 'index.json'))
+    os.replace(sources_tmp, os.path.join(output_dir, 'sources.json'))
+
+    print(f"Embeddings of {row - len(kept)} new images computed, {row} images saved to {vectors_file}")
+
+
+def load_embedding_store(output_dir=embedding_dir):
+    vectors_file = os.path.join(output_dir, 'vectors.npy')
+    mtime_ns = os.stat(vectors_file).st_mtime_ns
+
+    cached = store_cache.get(output_dir)
+    if cached is not None and cached['mtime_ns'] == mtime_ns:
+        return cached
+
+    # The vectors are memory-mapped read-only: the pages are shared by every worker
+    # through the OS page cache and nothing is copied into the process
+    with open(os.path.join(output_dir, 'index.json'), 'r') as f:
+        index = json.load(f)
+    store = {
+        'mtime_ns': mtime_ns,
+        'vectors': np.load(vectors_file, mmap_mode='r'),
+        'filenames': np.array(sorted(index, key=index.get)),
+        'positions': index,
+    }
+    store_cache[output_dir] = store
+    return store
+
+
+def embedding_scores(store, liked_positions):
+    # With normalized vectors, the summed cosine similarity to the liked images
+    # is the dot product with the sum of their vectors
+    profile = np.asarray(store['vectors'][np.sort(liked_positions)], dtype=np.float32).sum(axis=0)
+    return np.asarray(store['vectors'] @ profile.astype(store['vectors'].dtype), dtype=np.float32)
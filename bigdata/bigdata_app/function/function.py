@@ -2,19 +2,23 @@ import csv
 import urllib.request
 import zipfile
 import os
-import json
+import time
 import numpy as np
-import tensorflow
-import exifread
-from keras.applications import EfficientNetB0
-from keras.utils import load_img, img_to_array
-from keras.applications.resnet import ResNet50, preprocess_input, decode_predictions
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from collections import defaultdict
-from scipy.sparse import csr_matrix
-from sklearn.neighbors import NearestNeighbors
 import tqdm
+from .content_index import build_content_index
+from .batching import iter_image_batches, load_image_array, load_image_and_exif
+from .downloader import download_urls
+from .photos import build_photo_index
+from .preferences import add_user_preference
+from .metadata_store import checkpoint_path, load_metadata_records, append_metadata_records, rewrite_metadata_records, write_metadata, \
+    metadata_exists, read_metadata_records, compact_path, load_metadata
+from .embeddings import build_embedding_store
+from .text_features import build_text_features
+from .interactions import build_and_save_item_neighbors, get_interaction_matrix
+from .thumbnails import build_thumbnails
+from .inference import get_backend, predict_tags
+from .instrumentation import timer
+from .recommenders import *
 
 input_file = './bigdata_app/data/unsplash-research-dataset-lite-latest/photos.tsv000'
 output_dir = './bigdata_app/data/images/'
@@ -61,7 +65,7 @@ def download_unsplash_dataset(url, zip_file, extract_dir):
         print(f'Zip file {zip_file} does not exist.')
 
 
-def download_images(input_file, output_dir, num_images):
+def download_images(input_file, output_dir, num_images, concurrency=16, retries=3, backoff=0.5, resize=None, progress=None):
     # Check if the output directory exists
     if not os.path.isdir(output_dir):
         os.mkdir(output_dir)
@@ -77,248 +81,191 @@ def download_images(input_file, output_dir, num_images):
         return
 
     # Check if the specified number of images has already been downloaded
-    downloaded_images = [f for f in os.listdir(output_dir) if
-                         f.endswith('.jpg') or f.endswith('.jpeg') or f.endswith('.png')]
+    downloaded_images = {f for f in os.listdir(output_dir) if
+                         f.endswith('.jpg') or f.endswith('.jpeg') or f.endswith('.png')}
     if len(downloaded_images) >= num_images:
         print(f"The output directory {output_dir} already contains at least {num_images} images.")
         return
 
-    # Download the images
+    # List the images that still have to be downloaded
+    jobs = []
     with open(input_file, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f, delimiter='\t')
 
-        for i, row in tqdm.tqdm(enumerate(reader), total=num_images):
+        for i, row in enumerate(reader):
             if i >= num_images:
                 break
 
-            try:
-                image_url = row['photo_image_url']
-                image_path = os.path.join(output_dir, f"{row['photo_id']}.jpg")
+            image_name = f"{row['photo_id']}.jpg"
+            if image_name not in downloaded_images:
+                jobs.append((row['photo_image_url'], os.path.join(output_dir, image_name)))
 
-                # Check if the image has already been downloaded
-                if not os.path.exists(image_path):
-                    urllib.request.urlretrieve(image_url, image_path)
-            except Exception as e:
-                print(f"Failed to download image {i + 1}: {str(e)}")
+    # Download the images concurrently over a shared connection pool
+    num_new_images, num_failed = download_urls(jobs, concurrency, retries, backoff, resize, progress)
 
     # Count the number of downloaded images
-    downloaded_images = [f for f in os.listdir(output_dir) if
-                         f.endswith('.jpg') or f.endswith('.jpeg') or f.endswith('.png')]
-    num_downloaded_images = len(downloaded_images)
-    print(f"Downloaded a total of {num_downloaded_images} images.")
+    num_downloaded_images = len(downloaded_images) + num_new_images
+    print(f"Downloaded a total of {num_downloaded_images} images ({num_failed} failed).")
 
     # Check if any images were downloaded
     if num_downloaded_images == 0:
         print('No images were downloaded.')
 
 
-# Cache for the model
-model_cache = None
-
-# Load and cache the model
+# Load and cache the Keras model, TensorFlow is only imported here
 def load_model():
-    global model_cache
-    if model_cache is None:
-        model_cache = EfficientNetB0(weights='imagenet')
-    return model_cache
+    return get_backend('keras').model
 
-# Classify an image
-def classify_image(image_path):
-    # Load and preprocess the image
-    img = load_img(image_path, target_size=(224, 224))
-    x = img_to_array(img)
-    x = np.expand_dims(x, axis=0)
-    x = preprocess_input(x)
-
-    # Use the model to classify the image
-    model = load_model()
-    preds = model.predict(x)
-    decoded_preds = decode_predictions(preds, top=10)[0]
-
-    # Return a list of tags
-    tags = [pred[1] for pred in decoded_preds]
+# Classify a batch of images with the given inference backend
+def classify_images(images, backend=None):
+    _, tags = predict_tags(get_backend(backend), images)
+    # Return a list of tags for each image
     return tags
 
+# Classify an image
+def classify_image(image_path, backend=None):
+    # Load the image
+    x = load_image_array(image_path)
+    return classify_images(np.expand_dims(x, axis=0), backend)[0]
 
-def extract_image_metadata(input_dir, output_file):
+
+def extract_image_metadata(input_dir, output_file, batch_size=64, num_workers=4, checkpoint_file=None, progress=None, backend=None):
     # Check if the input directory exists
     if not os.path.isdir(input_dir):
         print(f'Input directory {input_dir} does not exist.')
         return
 
-    # Check if the output file exists
-    if os.path.exists(output_file):
-        print(f'Output file {output_file} already exists.')
+    # Load the images already processed from the checkpoint
+    if checkpoint_file is None:
+        checkpoint_file = checkpoint_path(output_file)
+    records, num_lines = load_metadata_records(checkpoint_file)
+
+    # List the images with their modification time and size
+    images = {}
+    for entry in os.scandir(input_dir):
+        if entry.name.endswith('.jpg') or entry.name.endswith('.jpeg') or entry.name.endswith('.png'):
+            stat = entry.stat()
+            images[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+    # Import an existing metadata file that has no checkpoint yet
+    if not records and metadata_exists(output_file):
+        for item in read_metadata_records(output_file):
+            if item['filename'] in images:
+                mtime_ns, size = images[item['filename']]
+                records[item['filename']] = dict(item, mtime_ns=mtime_ns, size=size)
+        rewrite_metadata_records(checkpoint_file, records.values())
+        num_lines = len(records)
+        print(f'Imported {len(records)} images from {output_file} into {checkpoint_file}')
+
+    # Only process the images that are new or changed since they were tagged
+    files = [file for file, (mtime_ns, size) in images.items()
+             if file not in records or (records[file]['mtime_ns'], records[file]['size']) != (mtime_ns, size)]
+    removed = [file for file in records if file not in images]
+
+    # The output is only current if it was written after the last checkpointed batch: a run interrupted
+    # between a checkpoint and the output leaves images that are in the checkpoint but not in the output
+    output_path = compact_path(output_file)
+    if not files and not removed and os.path.exists(output_path) and \
+            (not os.path.exists(checkpoint_file) or os.stat(output_path).st_mtime_ns >= os.stat(checkpoint_file).st_mtime_ns):
+        print(f'Output file {output_file} is up to date.')
         return
 
-    # Extract metadata from images
-    metadata = []
-    for file in os.listdir(input_dir):
-        if file.endswith('.jpg') or file.endswith('.jpeg') or file.endswith('.png'):
-            file_path = os.path.join(input_dir, file)
-            try:
-                with open(file_path, 'rb') as f:
-                    tags = classify_image(file_path)
-                    exif_tags = exifread.process_file(f, details=False, stop_tag='UNDEF')
-                    metadata.append({
-                        'filename': file,
-                        'tags': {str(tag): str(value) for tag, value in exif_tags.items() if tag != 'JPEGThumbnail'},
-                        'image_tags': tags
-                    })
-            except Exception as e:
-                print(f"Failed to extract metadata from {file}: {str(e)}")
+    paths = [os.path.join(input_dir, file) for file in files]
+
+    # Extract metadata from images: each image is read once and decoded by a pool of threads,
+    # then copied into a preallocated batch classified by batches of `batch_size`; every batch is checkpointed
+    start = time.perf_counter()
+    batch = np.empty((batch_size, 224, 224, 3), dtype=np.float32)
+    with tqdm.tqdm(total=len(paths), unit='img') as pbar:
+        for loaded, results, failures in iter_image_batches(paths, load_image_and_exif, batch_size, num_workers):
+            for file_path, e in failures:
+                print(f"Failed to extract metadata from {os.path.basename(file_path)}: {str(e)}")
+
+            if loaded:
+                try:
+                    for i, (x, _) in enumerate(results):
+                        batch[i] = x
+                    with timer('ingestion.classify_batch'):
+                        batch_tags = classify_images(batch[:len(results)], backend)
+                    batch_records = []
+                    for file_path, (_, exif_tags), tags in zip(loaded, results, batch_tags):
+                        file = os.path.basename(file_path)
+                        mtime_ns, size = images[file]
+                        batch_records.append({
+                            'filename': file,
+                            'tags': exif_tags,
+                            'image_tags': tags,
+                            'mtime_ns': mtime_ns,
+                            'size': size
+                        })
+                    append_metadata_records(checkpoint_file, batch_records)
+                    num_lines += len(batch_records)
+                    for record in batch_records:
+                        records[record['filename']] = record
+                except Exception as e:
+                    print(f"Failed to classify a batch of {len(loaded)} images: {str(e)}")
+
+            pbar.update(len(loaded) + len(failures))
+            if progress is not None:
+                progress(pbar.n, len(paths))
+
+    elapsed = time.perf_counter() - start
+
+    # Forget the images that were deleted and compact the checkpoint once it is mostly stale lines
+    for file in removed:
+        del records[file]
+    if removed or num_lines > 2 * len(records):
+        rewrite_metadata_records(checkpoint_file, records.values())
 
     # Write metadata to output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=4)
-
-    print(f"Metadata extracted from {len(metadata)} images and saved to {output_file}")
-
-
-
-def add_user_preference(user_id, image_id, preferences_file='./bigdata_app/data/user_preferences.json'):
-    if not os.path.exists(preferences_file):
-        with open(preferences_file, 'w') as f:
-            json.dump([], f)
-
-    with open(preferences_file, 'r') as f:
-        preferences = json.load(f)
-
-
-    preference = {'user_id': user_id, 'image_id': image_id}
-    preferences.append(preference)
-
-    with open(preferences_file, 'w') as f:
-        json.dump(preferences, f)
-
-
-def content_based_recommendation(user_id, metadata_file='./bigdata_app/data/metadata.json', preferences_file='./bigdata_app/data/user_preferences.json'):
-    # Load image metadata and user preferences
-    with open(metadata_file, 'r') as f:
-        metadata = json.load(f)
-
-    with open(preferences_file, 'r') as f:
-        preferences = json.load(f)
-
-    # Filter images liked by the user
-    user_preferences = [p for p in preferences if p['user_id'] == user_id]
-    liked_images = [p['image_id'] for p in user_preferences]
-
-    # Create a dictionary to associate image IDs with tags
-    image_tags = {item['filename']: ' '.join(item['image_tags']) for item in metadata}
-
-    try:
-        # Use a TfidfVectorizer to transform the tags into vectors
-        vectorizer = TfidfVectorizer()
-        image_vectors = vectorizer.fit_transform(image_tags.values())
-
-        # Calculate similarities between images
-        similarity_matrix = cosine_similarity(image_vectors)
-
-        # Find indices of images liked by the user
-        liked_image_indices = [list(image_tags.keys()).index(img_id) for img_id in liked_images]
-
-        # Calculate recommendation scores for each image based on their similarity
-        recommendation_scores = np.sum(similarity_matrix[liked_image_indices], axis=0)
-
-        # Find indices of recommended images
-        recommended_image_indices = np.argsort(recommendation_scores)[::-1]
-
-        # Return the IDs of the recommended images
-        recommended_image_ids = [list(image_tags.keys())[index] for index in recommended_image_indices]
-
-        # Filter images already liked by the user
-        recommended_image_ids = [img_id for img_id in recommended_image_ids if img_id not in liked_images]
-
-    except ValueError as e:
-        print(f"Error: {str(e)}")
-        print("Returning an empty list of recommendations.")
-        recommended_image_ids = []
+    num_images = write_metadata(output_file, records.values())
 
-    return recommended_image_ids[:10]
+    print(f"Metadata extracted from {len(files)} new images, {num_images} images saved to {output_file}")
+    print(f"Tagged {len(paths)} images in {elapsed:.1f}s ({len(paths) / max(elapsed, 1e-9):.1f} images/sec)")
 
 
 
+def insertDefaultData(progress=None, backend=None):
+    # `progress(stage, done, total)` is called as the ingestion goes, by the job runner
+    def stage(name):
+        if progress is None:
+            return None
+        progress(name, 0, None)
+        return lambda done, total: progress(name, done, total)
 
-def collaborative_filtering_recommendation(user_id, preferences_file='./bigdata_app/data/user_preferences.json', k=10):
-    # Charger les préférences des utilisateurs
-    with open(preferences_file, 'r') as f:
-        preferences = json.load(f)
-    # Créer une matrice utilisateur-image
-    user_ids = sorted(list(set([p['user_id'] for p in preferences])))
-    image_ids = sorted(list(set([p['image_id'] for p in preferences])))
-
-    user_id_to_index = {user_id: index for index, user_id in enumerate(user_ids)}
-    image_id_to_index = {image_id: index for index, image_id in enumerate(image_ids)}
-
-    user_image_matrix = np.zeros((len(user_ids), len(image_ids)))
-
-    for preference in preferences:
-        user_index = user_id_to_index[preference['user_id']]
-        image_index = image_id_to_index[preference['image_id']]
-        user_image_matrix[user_index, image_index] = 1
-
-    # Utiliser NearestNeighbors pour trouver les utilisateurs similaires
-    model_knn = NearestNeighbors(metric='cosine', algorithm='brute', n_neighbors=k, n_jobs=-1)
-    model_knn.fit(csr_matrix(user_image_matrix))
-
-    user_index = user_id_to_index[user_id]
-
-    # Trouver les k voisins les plus proches
-    k = min(k, user_image_matrix.shape[0] - 1)  # Ajoutez cette ligne pour limiter k
-    distances, indices = model_knn.kneighbors(user_image_matrix[user_index].reshape(1, -1), n_neighbors=k + 1)
-
-    # Trouver les images préférées par les utilisateurs similaires
-    similar_users_indices = indices.flatten()[1:]
-    similar_users_preferences = defaultdict(int)
-
-    for index in similar_users_indices:
-        for i, value in enumerate(user_image_matrix[index]):
-            if value == 1:
-                image_id = image_ids[i]
-                similar_users_preferences[image_id] += 1
-
-    # Trier les images en fonction de leur popularité parmi les utilisateurs similaires
-    recommended_image_ids = sorted(similar_users_preferences, key=similar_users_preferences.get, reverse=True)
-
-    # Filtrer les images déjà aimées par l'utilisateur
-    user_liked_images = [p['image_id'] for p in preferences if p['user_id'] == user_id]
-    recommended_image_ids = [img_id for img_id in recommended_image_ids if img_id not in user_liked_images]
-
-    return recommended_image_ids[:10]
-
-
-
-def hybrid_recommendation(user_id, alpha=0.5, metadata_file='./bigdata_app/data/metadata.json', preferences_file='./bigdata_app/data/user_preferences.json', k=10):
-    content_based_recs = content_based_recommendation(user_id, metadata_file, preferences_file)
-    collaborative_recs = collaborative_filtering_recommendation(user_id, preferences_file, k)
-
-    # Combiner les scores de recommandation des deux approches
-    combined_scores = defaultdict(float)
-    for i, image_id in enumerate(content_based_recs):
-        combined_scores[image_id] += (1 - alpha) * (len(content_based_recs) - i)
-
-    for i, image_id in enumerate(collaborative_recs):
-        combined_scores[image_id] += alpha * (len(collaborative_recs) - i)
-
-    # Trier les images en fonction de leur score de recommandation combiné
-    recommended_image_ids = sorted(combined_scores, key=combined_scores.get, reverse=True)
-
-    return recommended_image_ids[:10]
-
-
-def insertDefaultData():
     # Download the Unsplash dataset
-    download_unsplash_dataset(url, zip_file, extract_dir)
+    stage('download')
+    with timer('ingestion.download'):
+        download_unsplash_dataset(url, zip_file, extract_dir)
+
+    # Index the photo catalogue by photo_id
+    with timer('ingestion.photo_index'):
+        build_photo_index(input_file)
 
     # Download the images
     num_images = 500
-    download_images(input_file, output_dir, num_images)
+    with timer('ingestion.images'):
+        download_images(input_file, output_dir, num_images, progress=stage('images'))
 
     # Extract metadata from the images
     input_dir = './bigdata_app/data/images/'
-    output_file = './bigdata_app/data/metadata.json'
-    extract_image_metadata(input_dir, output_file)
+    output_file = './bigdata_app/data/metadata.npz'
+    with timer('ingestion.tag'):
+        extract_image_metadata(input_dir, output_file, progress=stage('tag'), backend=backend)
+
+    # Build the TF-IDF index used by the content based recommendation
+    stage('index')
+    with timer('ingestion.content_index'):
+        build_content_index(output_file)
+
+    # Hash the Unsplash descriptions and keywords of the catalogue images
+    build_text_features(load_metadata(output_file)['filenames'])
+
+    # Resized copies of the images served by the site
+    build_thumbnails()
+
+    # Store the EfficientNetB0 feature vectors of the new images
+    build_embedding_store(input_dir, progress=stage('embeddings'))
 
     # Simuler les préférences des utilisateurs
     add_user_preference(1, 'liZpmbRG4WQ.jpg')
@@ -328,6 +275,9 @@ def insertDefaultData():
     add_user_preference(3, '731BXpcasJI.jpg')
     add_user_preference(3, 'AMuKRdPBuek.jpg')
 
+    # Precompute the co-occurrence neighbors of the images used by the item-item recommender
+    build_and_save_item_neighbors(get_interaction_matrix())
+
     # Tester les recommandations basées sur le contenu
     content_recs = content_based_recommendation(1)
     print("Recommandations basées sur le contenu pour l'utilisateur 1:")
@@ -341,4 +291,4 @@ def insertDefaultData():
     # Tester les recommandations hybrides
     hybrid_recs = hybrid_recommendation(1)
     print("Recommandations hybrides pour l'utilisateur 1:")
-    print(hybrid_recs)
\ No newline at end of file
+    print(hybrid_recs)
@@ -0,0 +1,161 @@
+import os
+import numpy as np
+from .content_index import load_content_index, content_scores
+from .embeddings import load_embedding_store, embedding_scores, embedding_dir
+from .interactions import get_interaction_matrix, user_neighbor_votes, load_item_neighbors, item_neighbor_scores
+from .als import load_als, user_vector, als_scores
+from .text_features import load_text_features, text_scores
+from .instrumentation import timer, timed
+
+# Catalogue position of every column of another item space, keyed by the space
+catalogue_maps = {}
+
+
+def _catalogue_map(key, positions, item_ids):
+    # Extended incrementally when new items are appended to the other space
+    cached = catalogue_maps.get(key)
+    if cached is None:
+        # Forget the maps of an older catalogue
+        for old_key in [k for k in catalogue_maps if k[0] == key[0]]:
+            del catalogue_maps[old_key]
+    if cached is None or len(cached) > len(item_ids):
+        cached = np.zeros(0, dtype=np.int64)
+    if len(cached) < len(item_ids):
+        new = np.array([positions.get(item_id, -1) for item_id in item_ids[len(cached):]], dtype=np.int64)
+        cached = np.concatenate([cached, new])
+        catalogue_maps[key] = cached
+    return cached
+
+
+def _to_catalogue(scores, mapping, num_images):
+    # Move a score vector into the catalogue order, dropping the items outside the catalogue
+    result = np.zeros(num_images, dtype=np.float32)
+    mapping = mapping[:len(scores)]
+    known = mapping >= 0
+    np.add.at(result, mapping[known], scores[:len(mapping)][known])
+    return result
+
+
+@timed('hybrid.context')
+def load_recommendation_context(user_id, metadata_file='./bigdata_app/data/metadata.npz'):
+    # Everything a page view needs, loaded once and shared by all the components
+    index = load_content_index(metadata_file)
+    matrix = get_interaction_matrix()
+    user_image_matrix = matrix.csr()
+
+    user_index = matrix.user_index.get(user_id)
+    if user_index is None:
+        liked_columns = np.zeros(0, dtype=np.int32)
+    else:
+        liked_columns = user_image_matrix.indices[user_image_matrix.indptr[user_index]:user_image_matrix.indptr[user_index + 1]]
+
+    # The catalogue is the order of the content index; likes are moved to it through the matrix columns
+    matrix_map = _catalogue_map(('matrix', index['signature']), index['positions'], matrix.image_ids)
+    liked_positions = matrix_map[liked_columns]
+
+    return {
+        'user_id': user_id,
+        'index': index,
+        'matrix': matrix,
+        'user_image_matrix': user_image_matrix,
+        'liked_columns': liked_columns,
+        'liked_positions': liked_positions[liked_positions >= 0],
+        'matrix_map': matrix_map,
+        'num_images': len(index['filenames']),
+    }
+
+
+def content_component(context, **params):
+    return content_scores(context['index'], context['liked_positions']).astype(np.float32)
+
+
+def collaborative_component(context, k=10, **params):
+    votes = user_neighbor_votes(context['matrix'], context['user_id'], k)
+    if votes is None:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    return _to_catalogue(votes.astype(np.float32), context['matrix_map'], context['num_images'])
+
+
+def item_component(context, **params):
+    item_neighbors = load_item_neighbors()
+    if item_neighbors is None:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    image_ids = context['matrix'].image_ids
+    scores = item_neighbor_scores(item_neighbors, [image_ids[column] for column in context['liked_columns'].tolist()])
+    neighbors_map = _catalogue_map(('item', context['index']['signature'], item_neighbors['mtime_ns']),
+                                   context['index']['positions'], item_neighbors['image_ids'].tolist())
+    return _to_catalogue(scores, neighbors_map, context['num_images'])
+
+
+def embedding_component(context, embeddings_dir=embedding_dir, **params):
+    if not os.path.exists(os.path.join(embeddings_dir, 'vectors.npy')):
+        return np.zeros(context['num_images'], dtype=np.float32)
+    store = load_embedding_store(embeddings_dir)
+    store_map = _catalogue_map(('embeddings', context['index']['signature'], store['mtime_ns']),
+                               context['index']['positions'], store['filenames'].tolist())
+    filenames = context['index']['filenames']
+    liked = [store['positions'][name] for name in filenames[context['liked_positions']].tolist() if name in store['positions']]
+    if not liked:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    return _to_catalogue(np.maximum(embedding_scores(store, liked), 0), store_map, context['num_images'])
+
+
+def als_component(context, **params):
+    model = load_als()
+    if model is None:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    image_ids = context['matrix'].image_ids
+    vector = user_vector(model, context['user_id'], [image_ids[column] for column in context['liked_columns'].tolist()])
+    if vector is None:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    model_map = _catalogue_map(('als', context['index']['signature'], model['mtime_ns']),
+                               context['index']['positions'], model['image_ids'].tolist())
+    return _to_catalogue(np.maximum(als_scores(model, vector), 0), model_map, context['num_images'])
+
+
+def text_component(context, **params):
+    features = load_text_features()
+    if features is None:
+        return np.zeros(context['num_images'], dtype=np.float32)
+    features_map = _catalogue_map(('text', context['index']['signature'], features['mtime_ns']),
+                                  context['index']['positions'], features['filenames'].tolist())
+    filenames = context['index']['filenames']
+    liked = [features['positions'][name] for name in filenames[context['liked_positions']].tolist() if name in features['positions']]
+    return _to_catalogue(text_scores(features, liked), features_map, context['num_images'])
+
+
+# Score components available to the hybrid engine, each returning one score per catalogue image
+score_components = {
+    'content': content_component,
+    'collaborative': collaborative_component,
+    'item': item_component,
+    'embedding': embedding_component,
+    'als': als_component,
+    'text': text_component,
+}
+
+
+def hybrid_scores(context, weights, **params):
+    # Weighted sum of the components, each scaled to [0, 1] by its maximum
+    total = np.zeros(context['num_images'], dtype=np.float32)
+    for name, weight in weights.items():
+        if weight == 0:
+            continue
+        with timer(f'hybrid.{name}'):
+            scores = score_components[name](context, **params)
+        top = scores.max() if len(scores) else 0
+        if top > 0:
+            total += weight * (scores / top)
+    return total
+
+
+@timed('hybrid.top_n')
+def top_n(scores, n=10, exclude=None):
+    # Best n positions with a positive score, without sorting the whole catalogue
+    scores = scores.copy()
+    if exclude is not None and len(exclude):
+        scores[exclude] = 0
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+
+# Image tagging backends. The Keras model is the reference; the TFLite backends run a
+# converted copy of it (float16 or int8 weights) on a multi-threaded CPU interpreter.
+# TensorFlow is only imported when a backend is loaded.
+
+model_dir = './bigdata_app/data/models/'
+calibration_dir = './bigdata_app/data/images/'
+default_backend = 'keras'
+
+# Loaded backends, keyed by (name, num_threads); num_threads is None for the backends that ignore it
+backend_cache = {}
+
+
+class KerasBackend:
+    # The thread pools of TensorFlow are set once per process, so the Keras backend takes no thread count
+    name = 'keras'
+
+    def __init__(self):
+        from keras.applications import EfficientNetB0
+        self.model = EfficientNetB0(weights='imagenet')
+        self.model_path = None
+
+    def predict(self, x):
+        return self.model.predict(x, batch_size=len(x), verbose=0)
+
+
+class TFLiteBackend:
+    def __init__(self, quantization='float16', num_threads=None, calibration_images=None):
+        import tensorflow as tf
+        self.name = f'tflite-{quantization}'
+        self.model_path = os.path.join(model_dir, f'efficientnetb0_{quantization}.tflite')
+        if not os.path.exists(self.model_path):
+            convert_model(self.model_path, quantization, calibration_images)
+        self.interpreter = tf.lite.Interpreter(model_path=self.model_path, num_threads=num_threads or os.cpu_count())
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def predict(self, x):
+        # The interpreter is resized when the batch size changes (usually only for the last batch)
+        if self.batch_size != len(x):
+            self.interpreter.resize_tensor_input(self.input['index'], [len(x)] + list(x.shape[1:]))
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x)
+        self.interpreter.set_tensor(self.input['index'], x.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index']).astype(np.float32)
+
+
+def _calibration_dataset(images, limit=100):
+    # Representative inputs for the int8 ranges, from images of the catalogue
+    from keras.applications.resnet import preprocess_input
+
+    def dataset():
+        for x in images[:limit]:
+            yield [preprocess_input(np.asarray(x, dtype=np.float32)[np.newaxis])]
+    return dataset
+
+
+def _catalogue_images(input_dir, limit=100):
+    from .batching import load_image_array
+    if not os.path.isdir(input_dir):
+        return []
+    files = sorted(file for file in os.listdir(input_dir) if file.endswith(('.jpg', '.jpeg', '.png')))[:limit]
+    return [load_image_array(os.path.join(input_dir, file)) for file in files]
+
+
+def convert_model(model_path, quantization='float16', calibration_images=None):
+    import tensorflow as tf
+    from keras.applications import EfficientNetB0
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(EfficientNetB0(weights='imagenet'))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if not calibration_images:
+            calibration_images = _catalogue_images(calibration_dir)
+        if not calibration_images:
+            raise ValueError(f'The int8 conversion needs calibration images, none found in {calibration_dir}')
+        # Integer weights and activations, the input and output stay in float32
+        converter.representative_dataset = _calibration_dataset(calibration_images)
+    else:
+        raise ValueError(f'Unknown quantization {quantization}')
+
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    with open(model_path + '.tmp', 'wb') as f:
+        f.write(converter.convert())
+    os.replace(model_path + '.tmp', model_path)
+    return model_path
+
+
+backends = {
+    'keras': lambda num_threads=None, calibration_images=None: KerasBackend(),
+    'tflite-float16': lambda num_threads=None, calibration_images=None: TFLiteBackend('float16', num_threads),
+    'tflite-int8': lambda num_threads=None, calibration_images=None: TFLiteBackend('int8', num_threads, calibration_images),
+}
+
+
+def get_backend(name=None, num_threads=None, calibration_images=None):
+    name = name or default_backend
+    if name not in backends:
+        raise ValueError(f"Unknown inference backend {name}, expected one of {', '.join(backends)}")
+    key = (name, num_threads if name != 'keras' else None)
+    if key not in backend_cache:
+        backend_cache[key] = backends[name](num_threads=num_threads, calibration_images=calibration_images)
+    return backend_cache[key]
+
+
+def predict_tags(backend, images, top=10):
+    # Class probabilities and the tags of a batch of 224x224 images
+    from keras.applications.resnet import preprocess_input, decode_predictions
+
+    x = preprocess_input(np.asarray(images, dtype=np.float32))
+    preds = backend.predict(x)
+    decoded_preds = decode_predictions(preds, top=top)
+    return preds, [[pred[1] for pred in image_preds] for image_preds in decoded_preds]
+
+
+def compare_tags(reference_preds, reference_tags, preds, tags, atol=0.1, min_overlap=0.8):
+    # Agreement of a backend with the reference on the same images
+    top1 = np.mean([a[:1] == b[:1] for a, b in zip(reference_tags, tags)]) if tags else 1.0
+    overlap = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(reference_tags, tags)]) if tags else 1.0
+    max_diff = float(np.abs(reference_preds - preds).max()) if len(preds) else 0.0
+    return {
+        'top1_agreement': float(top1),
+        'tag_overlap': float(overlap),
+        'max_prob_diff': max_diff,
+        'within_tolerance': bool(max_diff <= atol and overlap >= min_overlap),
+    }
@@ -0,0 +1,97 @@
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+# Per-stage timings and counters of the recommender and the ingestion. Every timed stage goes
+# into a process-wide histogram, and into the timings of the current request when there is one.
+
+# Upper bounds of the histogram buckets, in milliseconds
+buckets_ms = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, float('inf'))
+
+histograms = {}
+counters = {}
+metrics_lock = threading.Lock()
+
+# Stage timings of the request being served, set by the middleware
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def observe(name, elapsed_ms):
+    with metrics_lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = {'buckets': [0] * len(buckets_ms), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets_ms):
+            if elapsed_ms <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['sum'] += elapsed_ms
+        histogram['count'] += 1
+
+    timings = request_timings.get()
+    if timings is not None:
+        total, count = timings.get(name, (0.0, 0))
+        timings[name] = (total + elapsed_ms, count + 1)
+
+
+def increment(name, value=1):
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def timer(name):
+    # Time a block as the stage `name`
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name):
+    # Time every call of the decorated function as the stage `name`
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request():
+    return request_timings.set({})
+
+
+def finish_request(token):
+    timings = request_timings.get()
+    request_timings.reset(token)
+    return timings or {}
+
+
+def metrics_snapshot():
+    with metrics_lock:
+        return ({name: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']} for name, h in histograms.items()},
+                dict(counters))
+
+
+def render_metrics():
+    # Prometheus text exposition format
+    snapshot, counts = metrics_snapshot()
+    lines = ['# TYPE recommender_stage_ms histogram']
+    for name in sorted(snapshot):
+        histogram = snapshot[name]
+        cumulative = 0
+        for bound, count in zip(buckets_ms, histogram['buckets']):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'recommender_stage_ms_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'recommender_stage_ms_sum{{stage="{name}"}} {histogram["sum"]:.3f}')
+        lines.append(f'recommender_stage_ms_count{{stage="{name}"}} {histogram["count"]}')
+    lines.append('# TYPE recommender_events_total counter')
+    for name in sorted(counts):
+        lines.append(f'recommender_events_total{{event="{name}"}} {counts[name]}')
+    return '\n'.join(lines) + '\n'
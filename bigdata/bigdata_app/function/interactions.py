@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from ..models import UserPreference
+from .ann import IVFIndex
+from .instrumentation import timer, timed, increment
+
+
+# Binary user x image like matrix, kept in memory and fed incrementally from the UserPreference table
+class InteractionMatrix:
+
+    def __init__(self):
+        self.user_ids = []
+        self.user_index = {}
+        self.image_ids = []
+        self.image_index = {}
+        # Coordinates of the likes, in growable buffers of which the first `num_likes` entries are used
+        self.rows = np.zeros(1024, dtype=np.int32)
+        self.cols = np.zeros(1024, dtype=np.int32)
+        self.num_likes = 0
+        self.last_id = 0
+        self.version = 0
+        # (number of likes, matrix) of the last CSR built
+        self._csr = None
+        self._lock = threading.Lock()
+
+    def _index(self, ids, index, key):
+        position = index.get(key)
+        if position is None:
+            position = index[key] = len(ids)
+            ids.append(key)
+        return position
+
+    def _append(self, rows, cols):
+        # Double the buffers when they are full, so that an append is amortized O(1) per like
+        needed = self.num_likes + len(rows)
+        if needed > len(self.rows):
+            capacity = max(needed, 2 * len(self.rows))
+            self.rows = np.concatenate([self.rows[:self.num_likes], np.zeros(capacity - self.num_likes, dtype=np.int32)])
+            self.cols = np.concatenate([self.cols[:self.num_likes], np.zeros(capacity - self.num_likes, dtype=np.int32)])
+        self.rows[self.num_likes:needed] = rows
+        self.cols[self.num_likes:needed] = cols
+        self.num_likes = needed
+
+    def refresh(self):
+        # Only read the likes recorded since the last refresh, by this process or another one
+        with self._lock, timer('interactions.refresh'):
+            new_likes = (UserPreference.objects.filter(id__gt=self.last_id)
+                         .order_by('id').values_list('id', 'user_id', 'image_id'))
+            rows, cols = [], []
+            for like_id, user_id, image_id in new_likes.iterator(chunk_size=10000):
+                rows.append(self._index(self.user_ids, self.user_index, user_id))
+                cols.append(self._index(self.image_ids, self.image_index, image_id))
+                self.last_id = like_id
+            if rows:
+                self._append(rows, cols)
+                increment('interactions.new_likes', len(rows))
+                self.version += 1
+        return self
+
+    def csr(self, max_delta_ratio=0.25):
+        # Only the likes added since the last build are turned into a sparse delta and added to it;
+        # the matrix is rebuilt from the coordinates when the delta is a large part of it.
+        # The buffers are read under the lock, a refresh appending to them in another thread
+        built = self._csr
+        if built is not None and built[0] == self.num_likes:
+            return built[1]
+        with self._lock:
+            built = self._csr
+            num_likes = self.num_likes
+            if built is not None and built[0] == num_likes:
+                return built[1]
+            shape = (len(self.user_ids), len(self.image_ids))
+            start = built[0] if built is not None and num_likes - built[0] <= max_delta_ratio * num_likes else 0
+            with timer('interactions.csr'):
+                matrix = csr_matrix((np.ones(num_likes - start, dtype=np.float32),
+                                     (self.rows[start:num_likes], self.cols[start:num_likes])), shape=shape)
+                if start:
+                    # The previous matrix padded with empty rows for the new users
+                    previous = built[1]
+                    indptr = np.concatenate([previous.indptr, np.full(shape[0] - previous.shape[0], previous.indptr[-1],
+                                                                      dtype=previous.indptr.dtype)])
+                    matrix = matrix + csr_matrix((previous.data, previous.indices, indptr), shape=shape)
+                matrix.sum_duplicates()
+                matrix.data[:] = 1
+            self._csr = (num_likes, matrix)
+        return matrix
+
+
+# Cache for the matrix of this process
+interaction_matrix_cache = None
+
+
+def get_interaction_matrix():
+    global interaction_matrix_cache
+    if interaction_matrix_cache is None:
+        interaction_matrix_cache = InteractionMatrix()
+    return interaction_matrix_cache.refresh()
+
+
+def refresh_interaction_matrix():
+    # Called after a like: fold it into the matrix if this process already holds one
+    if interaction_matrix_cache is not None:
+        interaction_matrix_cache.refresh()
+
+
+def normalized_rows(user_image_matrix):
+    # Rows are binary: the norm of a row is the square root of its number of likes
+    norms = np.sqrt(np.diff(user_image_matrix.indptr)).astype(np.float32)
+    normalized = user_image_matrix.copy()
+    normalized.data = np.repeat(1 / np.maximum(norms, 1e-12), np.diff(user_image_matrix.indptr)).astype(np.float32)
+    return normalized
+
+
+# Cache for the approximate user index of this process
+user_ann_cache = None
+
+
+def get_user_ann_index(matrix, nlist=64, nprobe=8, max_age=60):
+    # The clusters are retrained when the likes changed, at most once every `max_age` seconds;
+    # users that joined in between are added to the existing clusters
+    global user_ann_cache
+    cached = user_ann_cache
+    if cached is None or (cached['version'] != matrix.version and time.monotonic() - cached['built_at'] >= max_age):
+        ann = IVFIndex(nlist=nlist, nprobe=nprobe).build(normalized_rows(matrix.csr()))
+        cached = user_ann_cache = {'version': matrix.version, 'built_at': time.monotonic(), 'ann': ann}
+    elif len(cached['ann']) < len(matrix.user_ids):
+        cached['ann'].add(normalized_rows(matrix.csr()[len(cached['ann']):]))
+    return cached['ann']
+
+
+@timed('interactions.user_knn')
+def user_neighbor_votes(matrix, user_id, k=10, ann_index=None):
+    # Cosine kNN over the users followed by the sum of the neighbors' rows, all with sparse products
+    user_index = matrix.user_index.get(user_id)
+    if user_index is None:
+        return None
+
+    user_image_matrix = matrix.csr()
+    k = min(k, user_image_matrix.shape[0] - 1)
+    if k <= 0:
+        return np.zeros(user_image_matrix.shape[1], dtype=np.float32)
+
+    if ann_index is not None:
+        # Approximate search, restricted to the probed clusters of users
+        user_vector = normalized_rows(user_image_matrix[user_index])
+        neighbors, _ = ann_index.query(user_vector, k + 1)
+        neighbors = neighbors[neighbors != user_index][:k]
+    else:
+        norms = np.sqrt(np.diff(user_image_matrix.indptr)).astype(np.float32)
+        overlap = np.asarray((user_image_matrix @ user_image_matrix[user_index].T).todense()).ravel()
+        similarities = overlap / np.maximum(norms * norms[user_index], 1e-12)
+        similarities[user_index] = -np.inf
+        neighbors = np.argpartition(-similarities, k - 1)[:k]
+
+    return np.asarray(user_image_matrix[neighbors].sum(axis=0)).ravel()
+
+
+@timed('interactions.item_neighbors')
+def build_item_neighbors(user_image_matrix, top_k=50, chunk_size=2048):
+    # Item-item cosine similarity from co-occurrences, pruned to the top-K neighbors of each item
+    image_user_matrix = user_image_matrix.T.tocsr()
+    num_images = image_user_matrix.shape[0]
+    norms = np.sqrt(np.diff(image_user_matrix.indptr)).astype(np.float32)
+
+    chunks = []
+    for start in range(0, num_images, chunk_size):
+        stop = min(start + chunk_size, num_images)
+        co_occurrences = (image_user_matrix[start:stop] @ user_image_matrix).tocoo()
+        rows, cols, data = co_occurrences.row, co_occurrences.col, co_occurrences.data
+        data = data / np.maximum(norms[rows + start] * norms[cols], 1e-12)
+
+        # Drop the item itself and keep the K most similar items of every row
+        keep = rows + start != cols
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+        order = np.lexsort((-data, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        row_starts = np.searchsorted(rows, np.arange(stop - start))
+        rank = np.arange(len(rows)) - row_starts[rows]
+        keep = rank < top_k
+        chunks.append(csr_matrix((data[keep].astype(np.float32), (rows[keep], cols[keep])),
+                                 shape=(stop - start, num_images)))
+
+    if not chunks:
+        return csr_matrix((0, 0), dtype=np.float32)
+    return vstack(chunks).tocsr()
+
+
+item_neighbors_file = './bigdata_app/data/item_neighbors.npz'
+
+# Cache for the item neighbors of this process
+item_neighbors_cache = None
+
+
+def save_item_neighbors(path, neighbors, image_ids, top_k):
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, data=neighbors.data, indices=neighbors.indices, indptr=neighbors.indptr,
+             shape=np.array(neighbors.shape), image_ids=np.asarray(image_ids, dtype=str), top_k=top_k)
+    os.replace(tmp_path, path)
+
+
+def build_and_save_item_neighbors(matrix, path=item_neighbors_file, top_k=50):
+    # Offline step, run by the ingestion and the build_item_neighbors command, never by a web request
+    start = time.perf_counter()
+    user_image_matrix = matrix.csr()
+    neighbors = build_item_neighbors(user_image_matrix, top_k)
+    save_item_neighbors(path, neighbors, matrix.image_ids[:user_image_matrix.shape[1]], top_k)
+    print(f"Top {top_k} neighbors of {user_image_matrix.shape[1]} images built from {user_image_matrix.nnz} likes "
+          f"in {time.perf_counter() - start:.1f}s, saved to {path}")
+    return neighbors
+
+
+def load_item_neighbors(path=item_neighbors_file):
+    # Reloaded when the neighbors are rebuilt
+    global item_neighbors_cache
+    if not os.path.exists(path):
+        return None
+    mtime_ns = os.stat(path).st_mtime_ns
+    if item_neighbors_cache is None or item_neighbors_cache['mtime_ns'] != mtime_ns:
+        with np.load(path) as data:
+            image_ids = data['image_ids']
+            item_neighbors_cache = {
+                'mtime_ns': mtime_ns,
+                'neighbors': csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape'])),
+                'image_ids': image_ids,
+                'image_positions': {image_id: i for i, image_id in enumerate(image_ids.tolist())},
+            }
+    return item_neighbors_cache
+
+
+def item_neighbor_scores(item_neighbors, liked_image_ids):
+    # Sum of the neighbor lists of the liked items, one score per image of the saved neighbors:
+    # cost depends on the user's history only
+    neighbors = item_neighbors['neighbors']
+    liked = [item_neighbors['image_positions'][image_id] for image_id in liked_image_ids
+             if image_id in item_neighbors['image_positions']]
+    scores = np.zeros(neighbors.shape[1], dtype=np.float32)
+    if liked:
+        scores[:] = np.asarray(neighbors[liked].sum(axis=0)).ravel()
+    return scores
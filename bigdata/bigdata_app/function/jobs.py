@@ -0,0 +1,109 @@
+import os
+import time
+import traceback
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from ..models import IngestionJob
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def enqueue_ingestion_job():
+    # Single flight: a second request while a job is queued or running gets the existing job
+    try:
+        with transaction.atomic():
+            return IngestionJob.objects.create(), True
+    except IntegrityError:
+        return get_active_job(), False
+
+
+def get_active_job():
+    return IngestionJob.objects.filter(status__in=IngestionJob.ACTIVE).order_by('-id').first()
+
+
+def get_latest_job():
+    return IngestionJob.objects.order_by('-id').first()
+
+
+def job_status(job):
+    if job is None:
+        return {'status': None}
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def request_cancel(job_id):
+    return IngestionJob.objects.filter(pk=job_id, status__in=IngestionJob.ACTIVE).update(cancel_requested=True) > 0
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def requeue_orphaned_jobs():
+    # Jobs left running by a worker that died are queued again; every stage can resume
+    count = 0
+    for job in IngestionJob.objects.filter(status=IngestionJob.RUNNING):
+        if job.pid is None or not _pid_alive(job.pid):
+            count += IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.RUNNING).update(status=IngestionJob.QUEUED, pid=None)
+    return count
+
+
+def claim_next_job():
+    # Atomically move the oldest queued job to running, so that two workers never run the same job
+    for job in IngestionJob.objects.filter(status=IngestionJob.QUEUED).order_by('id'):
+        claimed = IngestionJob.objects.filter(pk=job.pk, status=IngestionJob.QUEUED).update(
+            status=IngestionJob.RUNNING, pid=os.getpid(), started_at=timezone.now(), updated_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def make_progress_callback(job, min_interval=1.0):
+    # Record the progress of each stage, at most once per `min_interval` seconds unless the stage changes,
+    # and stop the job when a cancellation was requested
+    last_write = [0.0]
+
+    def progress(stage, done, total):
+        now = time.monotonic()
+        if stage == job.stage and now - last_write[0] < min_interval and done != total:
+            return
+        last_write[0] = now
+
+        job.stage = stage
+        job.progress[stage] = {'done': done, 'total': total}
+        IngestionJob.objects.filter(pk=job.pk).update(stage=stage, progress=job.progress, updated_at=timezone.now())
+        if IngestionJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+    return progress
+
+
+def run_job(job, target):
+    # Run `target(progress)` and record how it ended
+    try:
+        target(make_progress_callback(job))
+        status, error = IngestionJob.DONE, ''
+    except JobCancelled:
+        status, error = IngestionJob.CANCELLED, ''
+    except Exception:
+        status, error = IngestionJob.FAILED, traceback.format_exc()
+    IngestionJob.objects.filter(pk=job.pk).update(status=status, error=error, pid=None,
+                                                  finished_at=timezone.now(), updated_at=timezone.now())
+    return status
@@ -0,0 +1,139 @@
+import os
+import json
+import numpy as np
+
+# Cache for the EXIF tags, only loaded when they are asked for
+exif_cache = {}
+
+
+def checkpoint_path(output_file):
+    return os.path.splitext(output_file)[0] + '.jsonl'
+
+
+def load_metadata_records(checkpoint_file):
+    # Read the JSON Lines checkpoint: one record per processed image, the last one wins
+    records = {}
+    num_lines = 0
+    if not os.path.exists(checkpoint_file):
+        return records, num_lines
+
+    with open(checkpoint_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            num_lines += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Line truncated by a crash during the last append
+                continue
+            records[record['filename']] = record
+    return records, num_lines
+
+
+def append_metadata_records(checkpoint_file, records):
+    # Append one chunk of records and make sure it reached the disk before going on
+    with open(checkpoint_file, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def rewrite_metadata_records(checkpoint_file, records):
+    # Compact the checkpoint so that it holds a single line per image
+    with open(checkpoint_file + '.tmp', 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def compact_path(metadata_file):
+    return os.path.splitext(metadata_file)[0] + '.npz'
+
+
+def exif_path(metadata_file):
+    return os.path.splitext(metadata_file)[0] + '_exif.npz'
+
+
+def _string_table(strings):
+    # Strings concatenated in one UTF-8 buffer with their offsets
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(data) for data in encoded], dtype=np.int64), out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def write_metadata(output_file, records):
+    # Write the metadata read by the recommenders as a columnar store, atomically:
+    # the image tags are ids in a tag vocabulary, the EXIF tags go to a separate file
+    records = list(records)
+    vocabulary = {}
+    tag_ids = [vocabulary.setdefault(tag, len(vocabulary)) for r in records for tag in r['image_tags']]
+    tag_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(r['image_tags']) for r in records], dtype=np.int64), out=tag_offsets[1:])
+    filenames = np.array([r['filename'] for r in records], dtype=str)
+
+    path = compact_path(output_file)
+    np.savez(path + '.tmp.npz', filenames=filenames, tag_vocabulary=np.array(list(vocabulary), dtype=str),
+             tag_ids=np.array(tag_ids, dtype=np.int32), tag_offsets=tag_offsets)
+    exif_data, exif_offsets = _string_table(json.dumps(r['tags']) for r in records)
+    np.savez(exif_path(output_file) + '.tmp.npz', filenames=filenames, data=exif_data, offsets=exif_offsets)
+
+    # The EXIF file goes first so that it is never older than the store
+    os.replace(exif_path(output_file) + '.tmp.npz', exif_path(output_file))
+    os.replace(path + '.tmp.npz', path)
+    return len(records)
+
+
+def metadata_exists(metadata_file):
+    return os.path.exists(compact_path(metadata_file)) or os.path.exists(os.path.splitext(metadata_file)[0] + '.json')
+
+
+def resolve_metadata_file(metadata_file):
+    # Path of the columnar store, converted from a metadata.json written by an older version if needed
+    path = compact_path(metadata_file)
+    legacy = os.path.splitext(metadata_file)[0] + '.json'
+    if os.path.exists(legacy) and (not os.path.exists(path) or os.stat(legacy).st_mtime_ns > os.stat(path).st_mtime_ns):
+        with open(legacy, 'r', encoding='utf-8') as f:
+            write_metadata(path, json.load(f))
+        print(f'Converted {legacy} to {path}')
+    return path
+
+
+def load_metadata(metadata_file):
+    # Filenames and tag ids of the images, without the EXIF tags
+    with np.load(resolve_metadata_file(metadata_file)) as data:
+        return {key: data[key] for key in data.files}
+
+
+def image_tags(metadata, i):
+    tag_ids = metadata['tag_ids'][metadata['tag_offsets'][i]:metadata['tag_offsets'][i + 1]]
+    return metadata['tag_vocabulary'][tag_ids].tolist()
+
+
+def load_exif(metadata_file):
+    # EXIF tags of every image, keyed by filename, loaded on first use
+    path = exif_path(resolve_metadata_file(metadata_file))
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = exif_cache.get(path)
+    if cached is None or cached['mtime_ns'] != mtime_ns:
+        with np.load(path) as data:
+            cached = {'mtime_ns': mtime_ns, 'filenames': data['filenames'], 'data': data['data'].tobytes(),
+                      'offsets': data['offsets']}
+            cached['positions'] = {filename: i for i, filename in enumerate(cached['filenames'].tolist())}
+        exif_cache[path] = cached
+    return cached
+
+
+def get_exif(metadata_file, filename):
+    exif = load_exif(metadata_file)
+    i = exif['positions'].get(filename)
+    if i is None:
+        return None
+    return json.loads(exif['data'][exif['offsets'][i]:exif['offsets'][i + 1]].decode('utf-8'))
+
+
+def read_metadata_records(metadata_file):
+    # Every record of the store, EXIF included
+    metadata = load_metadata(metadata_file)
+    return [{'filename': filename, 'tags': get_exif(metadata_file, filename), 'image_tags': image_tags(metadata, i)}
+            for i, filename in enumerate(metadata['filenames'].tolist())]
@@ -0,0 +1,101 @@
+import csv
+import logging
+import os
+from django.db import transaction
+from ..models import Photo
+from .instrumentation import timed
+
+photos_file = './bigdata_app/data/unsplash-research-dataset-lite-latest/photos.tsv000'
+
+# Set once the index is known to be populated, to skip the check on every lookup. The index is
+# loaded in a single transaction, so a populated index is always a complete one
+photo_index_ready = False
+photo_index_warned = False
+
+logger = logging.getLogger(__name__)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_photo_index(input_file=photos_file, batch_size=2000, force=False):
+    # Load the photo catalogue into the database once, keyed by photo_id
+    if not os.path.exists(input_file):
+        print(f'Input file {input_file} does not exist.')
+        return 0
+
+    # The whole catalogue is loaded in one transaction: a build that crashes halfway leaves no row,
+    # so that the next run builds it again instead of keeping a partial index
+    with transaction.atomic():
+        if Photo.objects.exists():
+            if not force:
+                return Photo.objects.count()
+            Photo.objects.all().delete()
+
+        count = 0
+        batch = []
+        with open(input_file, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f, delimiter='\t')
+            for row in reader:
+                batch.append(Photo(
+                    photo_id=row['photo_id'],
+                    photo_url=row.get('photo_url') or '',
+                    photo_image_url=row['photo_image_url'],
+                    photo_width=_to_int(row.get('photo_width')),
+                    photo_height=_to_int(row.get('photo_height')),
+                    photo_aspect_ratio=_to_float(row.get('photo_aspect_ratio')),
+                    photo_description=row.get('photo_description') or '',
+                    photographer_username=row.get('photographer_username') or '',
+                    photographer_first_name=row.get('photographer_first_name') or '',
+                    photographer_last_name=row.get('photographer_last_name') or '',
+                ))
+                if len(batch) >= batch_size:
+                    Photo.objects.bulk_create(batch, ignore_conflicts=True)
+                    count += len(batch)
+                    batch = []
+        if batch:
+            Photo.objects.bulk_create(batch, ignore_conflicts=True)
+            count += len(batch)
+
+    print(f'Photo index built with {count} photos from {input_file}')
+    return count
+
+
+def _photo_index_ready():
+    # The index is built by the ingestion or the build_photo_index command, never by a page request
+    global photo_index_ready, photo_index_warned
+    if not photo_index_ready:
+        photo_index_ready = Photo.objects.exists()
+        if not photo_index_ready and not photo_index_warned:
+            logger.warning('The photo index is empty, run the ingestion or the build_photo_index command')
+            photo_index_warned = True
+    return photo_index_ready
+
+
+def get_photos(image_names):
+    # Fetch the catalogue rows of several images (photo_id or filename) in one query
+    if not _photo_index_ready():
+        return {}
+    photo_ids = {name: name.split('.')[0] for name in image_names}
+    photos = Photo.objects.in_bulk(set(photo_ids.values()))
+    return {name: photos[photo_id] for name, photo_id in photo_ids.items() if photo_id in photos}
+
+
+@timed('photos.urls')
+def get_image_urls(image_names):
+    return {name: photo.photo_image_url for name, photo in get_photos(image_names).items()}
+
+
+def get_image_url(image_name):
+    return get_image_urls([image_name]).get(image_name)
@@ -0,0 +1,36 @@
+import json
+from ..models import UserPreference
+from .interactions import refresh_interaction_matrix
+from .recommendation_cache import invalidate_user_recommendations
+from .instrumentation import timed
+
+
+def add_user_preference(user_id, image_id):
+    # Single INSERT OR IGNORE: a like costs the same whatever the size of the history
+    UserPreference.objects.bulk_create([UserPreference(user_id=user_id, image_id=image_id)], ignore_conflicts=True)
+    refresh_interaction_matrix()
+    invalidate_user_recommendations(user_id)
+
+
+@timed('preferences.liked')
+def get_liked_images(user_id):
+    # Uses the (user_id, image_id) unique index
+    return list(UserPreference.objects.filter(user_id=user_id).order_by('id').values_list('image_id', flat=True))
+
+
+def has_preferences():
+    return UserPreference.objects.exists()
+
+
+def import_json_preferences(preferences_file):
+    # Import a list of {'user_id', 'image_id'} dicts, as written by the former JSON store
+    with open(preferences_file, 'r') as f:
+        preferences = json.load(f)
+
+    before = UserPreference.objects.count()
+    UserPreference.objects.bulk_create(
+        [UserPreference(user_id=p['user_id'], image_id=p['image_id']) for p in preferences],
+        batch_size=2000,
+        ignore_conflicts=True,
+    )
+    return UserPreference.objects.count() - before
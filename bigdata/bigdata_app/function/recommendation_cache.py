@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from .instrumentation import increment
+
+# Number of ranked candidates kept per user
+queue_size = 50
+
+
+def _key(user_id):
+    return f'recommendations:{user_id}'
+
+
+def next_recommendation(user_id, compute):
+    # Serve the next image of the user's precomputed queue, computing a new queue only when it is empty
+    queue = cache.get(_key(user_id))
+    if not queue:
+        increment('recommendation_cache.miss')
+        queue = compute()
+        if not queue:
+            return None
+    else:
+        increment('recommendation_cache.hit')
+    name_image = queue.pop(0)
+    cache.set(_key(user_id), queue)
+    return name_image
+
+
+def invalidate_user_recommendations(user_id):
+    # Only the entry of the user who liked an image is dropped
+    cache.delete(_key(user_id))
@@ -0,0 +1,195 @@
+import numpy as np
+from .content_index import load_content_index, get_content_ann_index, content_scores
+from .embeddings import load_embedding_store, embedding_scores, embedding_dir
+from .interactions import get_interaction_matrix, get_user_ann_index, user_neighbor_votes, load_item_neighbors, item_neighbor_scores
+from .preferences import get_liked_images
+from .hybrid import load_recommendation_context, hybrid_scores, top_n, _catalogue_map
+from .als import load_als, user_vector, als_scores
+from .seen import seen_positions, seen_mask
+from .metadata_store import metadata_exists
+from .instrumentation import timed
+
+# Serving side of the recommender: only NumPy/SciPy level dependencies, so that the web
+# workers never load TensorFlow. The ingestion and tagging code lives in function.py.
+
+
+@timed('recommend.content')
+def content_based_recommendation(user_id, metadata_file='./bigdata_app/data/metadata.npz', use_ann=False):
+    # Load the images liked by the user
+    liked_images = get_liked_images(user_id)
+
+    try:
+        # Load the precomputed TF-IDF index, rebuilt only when the metadata file changes
+        index = load_content_index(metadata_file)
+
+        # Find indices of images liked by the user
+        liked_image_indices = [index['positions'][img_id] for img_id in liked_images if img_id in index['positions']]
+
+        if use_ann:
+            # Approximate search of the images closest to the sum of the liked vectors
+            if not liked_image_indices:
+                return []
+            profile = index['image_vectors'][liked_image_indices].sum(axis=0)
+            exclude = np.union1d(liked_image_indices, seen_positions(user_id, index))
+            candidates, scores = get_content_ann_index(index).query(profile, 10 + len(exclude))
+            keep = ~np.isin(candidates, exclude) & (scores > 0)
+            return index['filenames'][candidates[keep]].tolist()[:10]
+
+        # Calculate recommendation scores from the neighbors of the liked images
+        recommendation_scores = content_scores(index, liked_image_indices)
+        recommendation_scores[liked_image_indices] = 0
+        recommendation_scores[seen_positions(user_id, index)] = 0
+
+        # Find indices of recommended images
+        candidates = np.flatnonzero(recommendation_scores > 0)
+        if len(candidates) > 10:
+            candidates = candidates[np.argpartition(-recommendation_scores[candidates], 9)[:10]]
+        recommended_image_indices = candidates[np.argsort(-recommendation_scores[candidates], kind='stable')]
+
+        # Return the IDs of the recommended images
+        recommended_image_ids = index['filenames'][recommended_image_indices].tolist()
+
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        print("Returning an empty list of recommendations.")
+        recommended_image_ids = []
+
+    return recommended_image_ids[:10]
+
+
+
+
+@timed('recommend.embedding')
+def embedding_based_recommendation(user_id, embeddings_dir=embedding_dir):
+    # Load the images liked by the user
+    liked_images = get_liked_images(user_id)
+
+    # Memory-mapped EfficientNetB0 feature vectors of the catalogue
+    store = load_embedding_store(embeddings_dir)
+    liked_image_indices = [store['positions'][img_id] for img_id in liked_images if img_id in store['positions']]
+    if not liked_image_indices:
+        return []
+
+    # Score every image with one dense dot product
+    recommendation_scores = embedding_scores(store, liked_image_indices)
+    recommendation_scores[liked_image_indices] = -np.inf
+
+    n = min(10, len(recommendation_scores))
+    top = np.argpartition(-recommendation_scores, n - 1)[:n]
+    top = top[np.argsort(-recommendation_scores[top], kind='stable')]
+    top = top[np.isfinite(recommendation_scores[top])]
+
+    return store['filenames'][top].tolist()
+
+
+@timed('recommend.collaborative')
+def collaborative_filtering_recommendation(user_id, k=10, use_ann=False, metadata_file='./bigdata_app/data/metadata.npz'):
+    # Matrice utilisateur-image creuse, mise à jour de façon incrémentale à chaque like
+    matrix = get_interaction_matrix()
+
+    # Votes des k utilisateurs les plus proches pour chaque image, recherche exacte ou approchée
+    ann_index = get_user_ann_index(matrix) if use_ann and matrix.user_ids else None
+    votes = user_neighbor_votes(matrix, user_id, k, ann_index)
+    if votes is None:
+        return []
+
+    # Filtrer les images déjà aimées par l'utilisateur
+    user_image_matrix = matrix.csr()
+    user_index = matrix.user_index[user_id]
+    votes[user_image_matrix.indices[user_image_matrix.indptr[user_index]:user_image_matrix.indptr[user_index + 1]]] = 0
+
+    # Filtrer les images déjà montrées, les colonnes de la matrice étant ramenées au catalogue
+    if metadata_exists(metadata_file):
+        index = load_content_index(metadata_file)
+        matrix_map = _catalogue_map(('matrix', index['signature']), index['positions'], matrix.image_ids)[:len(votes)]
+        known = np.flatnonzero(matrix_map >= 0)
+        votes[known[seen_mask(user_id, index)[matrix_map[known]]]] = 0
+
+    # Trier les images en fonction de leur popularité parmi les utilisateurs similaires
+    candidates = np.flatnonzero(votes)
+    recommended_image_indices = candidates[np.argsort(-votes[candidates], kind='stable')][:10]
+
+    return [matrix.image_ids[i] for i in recommended_image_indices]
+
+
+
+@timed('recommend.item')
+def item_based_recommendation(user_id):
+    # Voisins de chaque image précalculés hors ligne par la commande build_item_neighbors
+    item_neighbors = load_item_neighbors()
+    if item_neighbors is None:
+        return []
+
+    # Load the images liked by the user
+    liked_images = get_liked_images(user_id)
+
+    # Somme des listes de voisins des images aimées par l'utilisateur
+    scores = item_neighbor_scores(item_neighbors, liked_images)
+    scores[[item_neighbors['image_positions'][image_id] for image_id in liked_images if image_id in item_neighbors['image_positions']]] = 0
+
+    candidates = np.flatnonzero(scores)
+    if len(candidates) > 10:
+        candidates = candidates[np.argpartition(-scores[candidates], 9)[:10]]
+    recommended_image_indices = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    return item_neighbors['image_ids'][recommended_image_indices].tolist()
+
+
+
+@timed('recommend.als')
+def als_recommendation(user_id, n=10):
+    # Facteurs latents entraînés par la commande train_als, le vecteur de l'utilisateur
+    # est recalculé par un petit système linéaire quand il a aimé de nouvelles images
+    model = load_als()
+    if model is None:
+        return []
+    liked_images = get_liked_images(user_id)
+    vector = user_vector(model, user_id, liked_images)
+    if vector is None:
+        return []
+
+    # Un produit matrice-vecteur sur tout le catalogue, sans dépendre du nombre d'utilisateurs
+    scores = als_scores(model, vector)
+    scores[[model['image_positions'][img_id] for img_id in liked_images if img_id in model['image_positions']]] = -np.inf
+    n = min(n, len(scores))
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    top = top[np.isfinite(scores[top])]
+
+    return model['image_ids'][top].tolist()
+
+
+@timed('recommend.hybrid')
+def hybrid_recommendation(user_id, alpha=0.5, metadata_file='./bigdata_app/data/metadata.npz', k=10, weights=None, n=10):
+    # Historique de l'utilisateur et index chargés une seule fois pour toutes les composantes
+    context = load_recommendation_context(user_id, metadata_file)
+
+    # Combiner les scores normalisés des composantes, par défaut contenu et filtrage collaboratif
+    if weights is None:
+        weights = {'content': 1 - alpha, 'collaborative': alpha}
+    combined_scores = hybrid_scores(context, weights, k=k)
+
+    # Meilleures images hors images déjà aimées ou déjà montrées
+    exclude = np.union1d(context['liked_positions'], seen_positions(user_id, context['index']))
+    recommended_image_indices = top_n(combined_scores, n, exclude=exclude)
+
+    return context['index']['filenames'][recommended_image_indices].tolist()
+
+
+def random_images(n=10, metadata_file='./bigdata_app/data/metadata.npz', user_id=None):
+    # Images au hasard pour les utilisateurs qui n'ont encore rien aimé, de préférence jamais montrées
+    index = load_content_index(metadata_file)
+    candidates = np.arange(len(index['filenames']))
+    if user_id is not None:
+        unseen = np.flatnonzero(~seen_mask(user_id, index))
+        if len(unseen):
+            candidates = unseen
+    return index['filenames'][np.random.choice(candidates, min(n, len(candidates)), replace=False)].tolist()
+
+
+def unseen_images(user_id, image_names, metadata_file='./bigdata_app/data/metadata.npz'):
+    # Retirer d'une liste déjà calculée les images montrées ou aimées depuis
+    index = load_content_index(metadata_file)
+    mask = seen_mask(user_id, index)
+    positions = index['positions']
+    return [name for name in image_names if name not in positions or not mask[positions[name]]]
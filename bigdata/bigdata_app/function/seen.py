@@ -0,0 +1,45 @@
+import numpy as np
+from django.core.cache import cache
+from ..models import Impression, UserPreference
+from .instrumentation import timed
+
+
+# Images already shown to or liked by a user, kept in the cache as a sorted array of catalogue positions.
+# Only the rows recorded after the cached watermarks are read again, by this process or another one.
+
+def _key(user_id):
+    return f'seen:{user_id}'
+
+
+def record_impression(user_id, image_id):
+    Impression.objects.bulk_create([Impression(user_id=user_id, image_id=image_id)], ignore_conflicts=True)
+
+
+@timed('seen.positions')
+def seen_positions(user_id, index):
+    entry = cache.get(_key(user_id))
+    if entry is None or entry['signature'] != index['signature']:
+        entry = {'signature': index['signature'], 'positions': np.zeros(0, dtype=np.int32),
+                 'last_impression_id': 0, 'last_like_id': 0}
+
+    impressions = list(Impression.objects.filter(user_id=user_id, id__gt=entry['last_impression_id'])
+                       .values_list('id', 'image_id'))
+    likes = list(UserPreference.objects.filter(user_id=user_id, id__gt=entry['last_like_id'])
+                 .values_list('id', 'image_id'))
+    if impressions or likes:
+        new = [index['positions'].get(image_id, -1) for _, image_id in impressions + likes]
+        new = np.array(new, dtype=np.int32)
+        entry['positions'] = np.union1d(entry['positions'], new[new >= 0]).astype(np.int32)
+        if impressions:
+            entry['last_impression_id'] = max(row_id for row_id, _ in impressions)
+        if likes:
+            entry['last_like_id'] = max(row_id for row_id, _ in likes)
+        cache.set(_key(user_id), entry)
+    return entry['positions']
+
+
+def seen_mask(user_id, index):
+    # Boolean mask over the catalogue, for one vectorized masking of a score array
+    mask = np.zeros(len(index['filenames']), dtype=bool)
+    mask[seen_positions(user_id, index)] = True
+    return mask
@@ -0,0 +1,116 @@
+import contextlib
+import csv
+import io
+import os
+import sys
+import zipfile
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix
+from .instrumentation import timed
+
+# Hashed bag-of-words features of the Unsplash descriptions and keywords, one row per catalogue image.
+# The TSV files are streamed by chunks, from the zip when it is still there, and hashed without any
+# vocabulary so that the features of an image never depend on the rest of the catalogue.
+
+text_features_file = './bigdata_app/data/text_features.npz'
+dataset_zip = './bigdata_app/data/unsplash-research-dataset-lite-latest.zip'
+dataset_dir = './bigdata_app/data/unsplash-research-dataset-lite-latest'
+
+# Cache for the features of this process
+features_cache = None
+
+
+def _open_tsv(stack, name, zip_file=dataset_zip, extract_dir=dataset_dir):
+    # Text stream over a file of the dataset, read from the zip without extracting it if possible
+    if os.path.exists(zip_file) and os.path.getsize(zip_file) > 0:
+        archive = stack.enter_context(zipfile.ZipFile(zip_file))
+        member = next((info for info in archive.infolist() if os.path.basename(info.filename) == name), None)
+        if member is not None:
+            return io.TextIOWrapper(stack.enter_context(archive.open(member)), encoding='utf-8', newline='')
+    path = os.path.join(extract_dir, name)
+    if os.path.exists(path):
+        return stack.enter_context(open(path, 'r', encoding='utf-8', newline=''))
+    return None
+
+
+def _iter_chunks(name, columns, positions, chunk_size, **paths):
+    # (catalogue positions, texts) of the rows of the catalogue images, `chunk_size` rows at a time
+    csv.field_size_limit(sys.maxsize)
+    with contextlib.ExitStack() as stack:
+        f = _open_tsv(stack, name, **paths)
+        if f is None:
+            print(f'{name} not found, skipped')
+            return
+        rows, texts = [], []
+        for row in csv.DictReader(f, delimiter='\t'):
+            position = positions.get(row['photo_id'])
+            if position is None:
+                continue
+            rows.append(position)
+            texts.append(' '.join(row.get(column) or '' for column in columns))
+            if len(rows) >= chunk_size:
+                yield rows, texts
+                rows, texts = [], []
+        if rows:
+            yield rows, texts
+
+
+@timed('ingestion.text_features')
+def build_text_features(filenames, output_file=text_features_file, n_features=2 ** 18, chunk_size=10000, **paths):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.preprocessing import normalize
+
+    filenames = np.asarray(filenames, dtype=str)
+    positions = {os.path.splitext(filename)[0]: i for i, filename in enumerate(filenames.tolist())}
+    vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, dtype=np.float32)
+
+    # The hashed rows of every chunk go to the row of their image, duplicates being summed at the end
+    rows_parts, cols_parts, data_parts = [], [], []
+    sources = [('photos.tsv000', ['photo_description', 'ai_description']), ('keywords.tsv000', ['keyword'])]
+    for name, columns in sources:
+        for rows, texts in _iter_chunks(name, columns, positions, chunk_size, **paths):
+            hashed = vectorizer.transform(texts).tocoo()
+            rows_parts.append(np.asarray(rows, dtype=np.int32)[hashed.row])
+            cols_parts.append(hashed.col.astype(np.int32))
+            data_parts.append(hashed.data.astype(np.float32))
+
+    features = coo_matrix((np.concatenate(data_parts) if data_parts else np.zeros(0, dtype=np.float32),
+                           (np.concatenate(rows_parts) if rows_parts else np.zeros(0, dtype=np.int32),
+                            np.concatenate(cols_parts) if cols_parts else np.zeros(0, dtype=np.int32))),
+                          shape=(len(filenames), n_features)).tocsr()
+
+    # Sublinear term frequencies and unit rows, so that the dot product is a cosine similarity
+    features.data = np.log1p(features.data)
+    features = normalize(features, copy=False).astype(np.float32)
+
+    np.savez(output_file + '.tmp.npz', data=features.data, indices=features.indices, indptr=features.indptr,
+             shape=np.array(features.shape), filenames=filenames)
+    os.replace(output_file + '.tmp.npz', output_file)
+    print(f"Text features of {np.count_nonzero(np.diff(features.indptr))}/{len(filenames)} images saved to {output_file}")
+    return features
+
+
+def load_text_features(path=text_features_file):
+    # Reloaded when the features are rebuilt
+    global features_cache
+    if not os.path.exists(path):
+        return None
+    mtime_ns = os.stat(path).st_mtime_ns
+    if features_cache is None or features_cache['mtime_ns'] != mtime_ns:
+        with np.load(path) as data:
+            filenames = data['filenames']
+            features_cache = {
+                'mtime_ns': mtime_ns,
+                'matrix': csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape'])),
+                'filenames': filenames,
+                'positions': {filename: i for i, filename in enumerate(filenames.tolist())},
+            }
+    return features_cache
+
+
+def text_scores(features, liked_positions):
+    # Cosine similarity of every image with the sum of the liked images, one sparse product
+    if not len(liked_positions):
+        return np.zeros(features['matrix'].shape[0], dtype=np.float32)
+    profile = np.asarray(features['matrix'][liked_positions].sum(axis=0)).ravel()
+    return features['matrix'] @ profile.astype(np.float32)
@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .instrumentation import timed, increment
+
+# Resized copies of the downloaded images, served by the thumbnail view instead of the full
+# resolution Unsplash URL. They are built during the ingestion or on first request, and the
+# least recently used ones are deleted when the directory grows over `max_cache_bytes`.
+
+images_dir = './bigdata_app/data/images/'
+thumbnail_dir = './bigdata_app/data/thumbnails/'
+max_cache_bytes = 512 * 2 ** 20
+
+# Largest side of each size, in pixels
+thumbnail_sizes = {'small': 320, 'medium': 800}
+thumbnail_formats = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+
+# Hits only refresh the access time of a thumbnail once per interval, in seconds
+touch_interval = 3600
+
+image_name_pattern = re.compile(r'^[A-Za-z0-9_-]+\.(jpg|jpeg|png)$')
+
+# Total size of the directory, counted once and then kept up to date by this process
+cache_bytes = None
+cache_lock = threading.Lock()
+
+
+def source_path(image_name):
+    # Local image, None for a name that is not a plain image file name
+    if not image_name_pattern.match(image_name or ''):
+        return None
+    path = os.path.join(images_dir, image_name)
+    return path if os.path.exists(path) else None
+
+
+def thumbnail_path(image_name, size, fmt):
+    return os.path.join(thumbnail_dir, size, f'{os.path.splitext(image_name)[0]}.{fmt}')
+
+
+def _scan():
+    entries = []
+    for size in os.listdir(thumbnail_dir) if os.path.isdir(thumbnail_dir) else []:
+        for entry in os.scandir(os.path.join(thumbnail_dir, size)):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def _account(added):
+    # Evict the least recently used thumbnails once the directory is over its cap
+    global cache_bytes
+    with cache_lock:
+        if cache_bytes is None:
+            cache_bytes = sum(size for _, size, _ in _scan())
+        else:
+            cache_bytes += added
+        if cache_bytes <= max_cache_bytes:
+            return
+        entries = sorted(_scan())
+        cache_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if cache_bytes <= 0.9 * max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+                cache_bytes -= size
+                increment('thumbnails.evicted')
+            except FileNotFoundError:
+                pass
+
+
+@timed('thumbnails.build')
+def build_thumbnail(image_name, size='medium', fmt='webp'):
+    source = source_path(image_name)
+    if source is None:
+        return None
+    path = thumbnail_path(image_name, size, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # The JPEG is decoded at a reduced scale close to the thumbnail, then resized.
+    # PIL is only loaded by the processes that build a thumbnail
+    from PIL import Image
+    side = thumbnail_sizes[size]
+    with Image.open(source) as img:
+        img.draft('RGB', (side, side))
+        img = img.convert('RGB')
+        img.thumbnail((side, side))
+        tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        try:
+            img.save(tmp_path, format=thumbnail_formats[fmt][0], quality=80)
+            os.replace(tmp_path, path)
+        finally:
+            # Left behind only if the encoding or the rename failed
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _account(os.path.getsize(path))
+    return path
+
+
+def get_thumbnail(image_name, size='medium', fmt='webp'):
+    # Path of the thumbnail, built if it is missing or older than the image
+    source = source_path(image_name)
+    if source is None or size not in thumbnail_sizes or fmt not in thumbnail_formats:
+        return None
+    path = thumbnail_path(image_name, size, fmt)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+    if stat is None or stat.st_mtime < os.stat(source).st_mtime:
+        increment('thumbnails.miss')
+        return build_thumbnail(image_name, size, fmt)
+
+    increment('thumbnails.hit')
+    now = time.time()
+    if now - stat.st_mtime > touch_interval:
+        # The modification time doubles as the last access time of the LRU
+        os.utime(path, (now, now))
+    return path
+
+
+def _prebuild(job):
+    try:
+        return get_thumbnail(*job)
+    except Exception as e:
+        print(f"Failed to build the thumbnail of {job[0]}: {str(e)}")
+        return None
+
+
+@timed('ingestion.thumbnails')
+def build_thumbnails(sizes=('medium',), formats=('webp', 'jpeg'), num_workers=4):
+    # Prebuild the thumbnails of the downloaded images, the decoding running in a pool of threads
+    names = [name for name in os.listdir(images_dir) if image_name_pattern.match(name)] if os.path.isdir(images_dir) else []
+    jobs = [(name, size, fmt) for name in names for size in sizes for fmt in formats]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        built = sum(1 for path in executor.map(_prebuild, jobs) if path is not None)
+    print(f'{built} thumbnails of {len(names)} images in {thumbnail_dir}')
+    return built
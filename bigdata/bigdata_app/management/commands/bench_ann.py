@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.ann import IVFIndex, benchmark_index
+from bigdata_app.function.content_index import load_content_index
+from bigdata_app.function.interactions import get_interaction_matrix, normalized_rows
+
+
+class Command(BaseCommand):
+    help = 'Measure recall@k and latency of the IVF index against the exact brute-force search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['content', 'users', 'synthetic'], default='content')
+        parser.add_argument('--metadata-file', default='./bigdata_app/data/metadata.npz')
+        parser.add_argument('--size', type=int, default=100000, help='Number of synthetic vectors')
+        parser.add_argument('--dim', type=int, default=256, help='Dimension of the synthetic vectors')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nlist', type=int, default=64)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+
+        if options['source'] == 'content':
+            vectors = load_content_index(options['metadata_file'])['image_vectors']
+        elif options['source'] == 'users':
+            vectors = normalized_rows(get_interaction_matrix().csr())
+        else:
+            # Clustered unit vectors, closer to real embeddings than uniform noise
+            centers = rng.normal(size=(max(options['size'] // 500, 1), options['dim']))
+            vectors = centers[rng.integers(0, len(centers), options['size'])]
+            vectors = vectors + 0.5 * rng.normal(size=vectors.shape)
+            vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+        queries = [vectors[i] for i in rng.choice(vectors.shape[0], min(options['queries'], vectors.shape[0]), replace=False)]
+        index = IVFIndex(nlist=options['nlist']).build(vectors)
+        results = benchmark_index(index, vectors, queries, options['k'], options['nprobe'])
+
+        self.stdout.write(f"{options['source']}: {vectors.shape[0]} vectors of dimension {vectors.shape[1]}, k={options['k']}")
+        for result in results:
+            self.stdout.write(f"{result['index']:>6} nprobe={str(result['nprobe']):>4} "
+                              f"recall={result['recall']:.3f} latency={result['latency_ms']:.3f}ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'source': options['source'], 'shape': list(vectors.shape), 'k': options['k'], 'results': results}, f, indent=4)
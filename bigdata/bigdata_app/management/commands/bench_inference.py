@@ -0,0 +1,80 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.batching import load_image_array
+from bigdata_app.function.inference import backends, get_backend, predict_tags, compare_tags
+
+
+def current_rss_mb():
+    # Resident memory of the process, from /proc when available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput, memory and tags of the image tagging backends on the same images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input-dir', default='./bigdata_app/data/images/')
+        parser.add_argument('--limit', type=int, default=256, help='Number of images of the benchmark')
+        parser.add_argument('--backend', choices=list(backends), nargs='+', default=list(backends))
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--threads', type=int, help='Threads of the TFLite interpreter (default: all the cores)')
+        parser.add_argument('--atol', type=float, default=0.1, help='Largest accepted probability difference with keras')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        files = sorted(file for file in os.listdir(options['input_dir'])
+                       if file.endswith(('.jpg', '.jpeg', '.png')))[:options['limit']]
+        images = np.stack([load_image_array(os.path.join(options['input_dir'], file)) for file in files])
+        self.stdout.write(f'{len(images)} images from {options["input_dir"]}')
+
+        # The Keras model is the reference of the tags, it always runs first
+        names = ['keras'] + [name for name in options['backend'] if name != 'keras']
+        reference = None
+        results = []
+        for name in names:
+            rss_before = current_rss_mb()
+            backend = get_backend(name, options['threads'], calibration_images=list(images[:100]))
+            model_mb = current_rss_mb() - rss_before
+
+            # Warm up on one batch, then time the whole set
+            predict_tags(backend, images[:options['batch_size']])
+            start = time.perf_counter()
+            preds, tags = [], []
+            for i in range(0, len(images), options['batch_size']):
+                batch_preds, batch_tags = predict_tags(backend, images[i:i + options['batch_size']])
+                preds.append(batch_preds)
+                tags.extend(batch_tags)
+            elapsed = time.perf_counter() - start
+            preds = np.concatenate(preds)
+
+            if reference is None:
+                reference = (preds, tags)
+            result = {
+                'backend': name,
+                'images_per_sec': len(images) / max(elapsed, 1e-9),
+                'model_memory_mb': model_mb,
+                'model_file_mb': os.path.getsize(backend.model_path) / 2 ** 20 if backend.model_path else None,
+            }
+            result.update(compare_tags(reference[0], reference[1], preds, tags, atol=options['atol']))
+            results.append(result)
+
+            if name in options['backend']:
+                self.stdout.write(f"{name:>15} {result['images_per_sec']:.1f} img/s memory={model_mb:.0f}MB "
+                                  f"top1={result['top1_agreement']:.3f} overlap={result['tag_overlap']:.3f} "
+                                  f"max_diff={result['max_prob_diff']:.4f} "
+                                  f"{'ok' if result['within_tolerance'] else 'OUT OF TOLERANCE'}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'images': len(images), 'batch_size': options['batch_size'],
+                           'results': [r for r in results if r['backend'] in options['backend']]}, f, indent=4)
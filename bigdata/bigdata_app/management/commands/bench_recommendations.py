@@ -0,0 +1,192 @@
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from bigdata_app.models import Photo, UserPreference
+from bigdata_app.function.metadata_store import write_metadata
+from bigdata_app.function.interactions import refresh_interaction_matrix
+from bigdata_app.function.content_index import build_content_index
+from bigdata_app.function.recommenders import (content_based_recommendation, collaborative_filtering_recommendation,
+                                               hybrid_recommendation)
+
+recommenders = {
+    'content': content_based_recommendation,
+    'collaborative': collaborative_filtering_recommendation,
+    'hybrid': hybrid_recommendation,
+}
+
+
+def latency_stats(latencies):
+    latencies = np.array(latencies) * 1000
+    return {
+        'count': len(latencies),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def generate_catalogue(num_images, vocabulary_size, tags_per_image, rng, batch_size=5000):
+    # Images tagged from a Zipf-like vocabulary, so that a few tags are shared by many images
+    filenames = [f'bench{i:07d}.jpg' for i in range(num_images)]
+    popularity = 1 / np.arange(1, vocabulary_size + 1)
+    tags = rng.choice(vocabulary_size, size=(num_images, tags_per_image), p=popularity / popularity.sum())
+    write_metadata('./bigdata_app/data/metadata.npz',
+                   ({'filename': filename, 'tags': {}, 'image_tags': [f'tag{t}' for t in row]}
+                    for filename, row in zip(filenames, tags.tolist())))
+
+    for start in range(0, num_images, batch_size):
+        Photo.objects.bulk_create([Photo(photo_id=filename.split('.')[0], photo_url='',
+                                         photo_image_url=f'https://example.com/{filename}')
+                                   for filename in filenames[start:start + batch_size]])
+    return filenames
+
+
+def generate_preferences(filenames, num_users, min_likes, max_likes, rng, batch_size=5000):
+    # Popular images get most of the likes, as on the real site
+    popularity = 1 / np.arange(1, len(filenames) + 1) ** 0.8
+    popularity /= popularity.sum()
+    batch, count = [], 0
+    for user_id in range(1, num_users + 1):
+        num_likes = min(int(rng.integers(min_likes, max_likes + 1)), len(filenames))
+        for image in np.unique(rng.choice(len(filenames), size=num_likes, p=popularity)):
+            batch.append(UserPreference(user_id=user_id, image_id=filenames[image]))
+        if len(batch) >= batch_size:
+            UserPreference.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    UserPreference.objects.bulk_create(batch)
+    return count + len(batch)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the recommenders and the home page on a synthetic catalogue in a test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=1000, help='Size of the synthetic catalogue')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--min-likes', type=int, default=1)
+        parser.add_argument('--max-likes', type=int, default=20)
+        parser.add_argument('--vocabulary', type=int, default=1000, help='Number of distinct image tags')
+        parser.add_argument('--tags-per-image', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=200, help='Timed calls of each recommender')
+        parser.add_argument('--page-views', type=int, default=200, help='Requests of the home page load test')
+        parser.add_argument('--like-rate', type=float, default=0.1, help='Share of the page views that like the image')
+        parser.add_argument('--recommender', choices=list(recommenders), nargs='+', default=list(recommenders))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        output = os.path.abspath(options['output']) if options['output'] else None
+        rng = np.random.default_rng(options['seed'])
+
+        # The data files are relative to the working directory: a temporary one keeps them apart
+        # from the real catalogue, and the likes go to a throwaway test database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        cwd = os.getcwd()
+        workdir = tempfile.TemporaryDirectory(prefix='bench_recommendations_')
+        try:
+            os.chdir(workdir.name)
+            os.makedirs('./bigdata_app/data/')
+            cache.clear()
+            report = self.run(options, rng)
+        finally:
+            os.chdir(cwd)
+            workdir.cleanup()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=4)
+            self.stdout.write(f'Report written to {output}')
+
+    def run(self, options, rng):
+        start = time.perf_counter()
+        filenames = generate_catalogue(options['images'], options['vocabulary'], options['tags_per_image'], rng)
+        num_likes = generate_preferences(filenames, options['users'], options['min_likes'], options['max_likes'], rng)
+        refresh_interaction_matrix()
+        self.stdout.write(f"{len(filenames)} images, {options['users']} users, {num_likes} likes "
+                          f"generated in {time.perf_counter() - start:.1f}s")
+
+        # Built offline as by the ingestion, the recommenders only load it
+        start = time.perf_counter()
+        build_content_index('./bigdata_app/data/metadata.npz')
+        report_build_ms = (time.perf_counter() - start) * 1000
+
+        report = {
+            'config': {key: options[key] for key in ('images', 'users', 'min_likes', 'max_likes', 'vocabulary',
+                                                     'tags_per_image', 'requests', 'page_views', 'like_rate', 'seed')},
+            'likes': num_likes,
+            'content_index_build_ms': report_build_ms,
+            'platform': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()},
+            'recommenders': {},
+        }
+
+        user_ids = rng.integers(1, options['users'] + 1, size=options['requests']).tolist()
+        for name in options['recommender']:
+            recommend = recommenders[name]
+
+            # First call with the allocations traced: it loads the indexes, so it gives the peak memory
+            tracemalloc.start()
+            cold_start = time.perf_counter()
+            recommend(user_ids[0])
+            cold_ms = (time.perf_counter() - cold_start) * 1000
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+            # Then the warm latency, without tracing
+            latencies = []
+            for user_id in user_ids:
+                call_start = time.perf_counter()
+                recommend(user_id)
+                latencies.append(time.perf_counter() - call_start)
+
+            result = dict(latency_stats(latencies), cold_ms=cold_ms, peak_memory_mb=peak_mb)
+            report['recommenders'][name] = result
+            self.stdout.write(f"{name:>14} p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+                              f"cold={cold_ms:.0f}ms peak={peak_mb:.1f}MB")
+
+        report['accueil'] = self.load_test(options, rng)
+        return report
+
+    def load_test(self, options, rng):
+        # Page views of a logged in user who has likes, some of them liking the image shown
+        user = User.objects.create_user('bench', password='bench')
+        client = Client()
+        client.force_login(user)
+        url = reverse('accueil')
+
+        latencies, statuses = [], {}
+        name_image = None
+        start = time.perf_counter()
+        for _ in range(options['page_views']):
+            request_start = time.perf_counter()
+            if name_image and rng.random() < options['like_rate']:
+                response = client.post(url, {'like': '1', 'image': name_image})
+            else:
+                response = client.get(url)
+            latencies.append(time.perf_counter() - request_start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            name_image = response.context['name_image'] if response.context else None
+        elapsed = time.perf_counter() - start
+
+        result = dict(latency_stats(latencies), requests_per_sec=len(latencies) / max(elapsed, 1e-9),
+                      statuses={str(status): count for status, count in statuses.items()})
+        self.stdout.write(f"{'accueil_view':>14} p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+                          f"{result['requests_per_sec']:.0f} req/s statuses={result['statuses']}")
+        return result
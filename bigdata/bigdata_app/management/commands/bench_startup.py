@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Each scenario runs in a fresh interpreter so that nothing is already imported
+probe = '''
+import json, os, resource, sys, time
+start = time.perf_counter()
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bigdata.settings')
+django.setup()
+for module in sys.argv[1:]:
+    __import__(module)
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'tensorflow_loaded': 'tensorflow' in sys.modules,
+    'keras_loaded': 'keras' in sys.modules,
+    'image_libraries_loaded': sorted(name for name in ('PIL', 'exifread', 'sklearn') if name in sys.modules),
+}))
+'''
+
+scenarios = {
+    # What a web worker imports to serve the pages
+    'serving': ['bigdata.urls'],
+    # The ingestion worker, which loads TensorFlow when it classifies images
+    'ingestion': ['bigdata.urls', 'bigdata_app.function.function', 'keras.applications'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure the startup time and memory of the serving and ingestion import paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--scenario', choices=list(scenarios), nargs='+', default=list(scenarios))
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        results = []
+        for name in options['scenario']:
+            runs = []
+            for _ in range(options['repeat']):
+                process = subprocess.run([sys.executable, '-c', probe] + scenarios[name], cwd=settings.BASE_DIR,
+                                         capture_output=True, text=True, env=os.environ.copy())
+                if process.returncode != 0:
+                    self.stderr.write(f"{name}: {process.stderr.strip().splitlines()[-1]}")
+                    break
+                runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+            if not runs:
+                continue
+
+            result = {
+                'scenario': name,
+                'seconds': min(run['seconds'] for run in runs),
+                'max_rss_mb': min(run['max_rss_mb'] for run in runs),
+                'tensorflow_loaded': runs[0]['tensorflow_loaded'],
+                'keras_loaded': runs[0]['keras_loaded'],
+                'image_libraries_loaded': runs[0]['image_libraries_loaded'],
+            }
+            results.append(result)
+            self.stdout.write(f"{name:>10} startup={result['seconds']:.2f}s rss={result['max_rss_mb']:.0f}MB "
+                              f"tensorflow={'yes' if result['tensorflow_loaded'] else 'no'} "
+                              f"ingestion_libraries={','.join(result['image_libraries_loaded']) or 'none'}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'repeat': options['repeat'], 'results': results}, f, indent=4)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.content_index import index_dir, build_content_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the TF-IDF index and top-K neighbors served by the content based recommendation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metadata-file', default='./bigdata_app/data/metadata.npz')
+        parser.add_argument('--output-dir', default=index_dir)
+        parser.add_argument('--top-k', type=int, default=50)
+
+    def handle(self, *args, **options):
+        build_content_index(options['metadata_file'], options['output_dir'], options['top_k'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.interactions import item_neighbors_file, build_and_save_item_neighbors, get_interaction_matrix
+
+
+class Command(BaseCommand):
+    help = 'Precompute the top-K co-occurrence neighbors of every image used by the item-item recommender'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=50)
+        parser.add_argument('--output', default=item_neighbors_file)
+
+    def handle(self, *args, **options):
+        build_and_save_item_neighbors(get_interaction_matrix(), options['output'], options['top_k'])
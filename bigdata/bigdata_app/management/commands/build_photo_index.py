@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.photos import photos_file, build_photo_index
+
+
+class Command(BaseCommand):
+    help = 'Load the Unsplash photo catalogue into the Photo table, keyed by photo_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input-file', default=photos_file)
+        parser.add_argument('--force', action='store_true', help='Replace an existing index')
+
+    def handle(self, *args, **options):
+        count = build_photo_index(options['input_file'], force=options['force'])
+        self.stdout.write(f'{count} photos in the index')
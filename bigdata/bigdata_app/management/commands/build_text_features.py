@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.metadata_store import load_metadata
+from bigdata_app.function.text_features import build_text_features, text_features_file
+
+
+class Command(BaseCommand):
+    help = 'Hash the Unsplash descriptions and keywords of the catalogue images into sparse text features'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metadata-file', default='./bigdata_app/data/metadata.npz')
+        parser.add_argument('--n-features', type=int, default=2 ** 18)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='TSV rows hashed at a time')
+        parser.add_argument('--output', default=text_features_file)
+
+    def handle(self, *args, **options):
+        build_text_features(load_metadata(options['metadata_file'])['filenames'], options['output'],
+                            options['n_features'], options['chunk_size'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.batch_recommendations import compute_recommendations
+from bigdata_app.function.recommendation_cache import queue_size
+
+
+class Command(BaseCommand):
+    help = 'Precompute the top-N recommendations of every user (or of the users with new likes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--changed-only', action='store_true', help='Only recompute the users who liked an image since the last run')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--shard-size', type=int, default=256)
+        parser.add_argument('-n', type=int, default=queue_size)
+
+    def handle(self, *args, **options):
+        compute_recommendations(n=options['n'], workers=options['workers'], shard_size=options['shard_size'],
+                                changed_only=options['changed_only'])
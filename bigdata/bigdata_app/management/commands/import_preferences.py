@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.preferences import import_json_preferences
+
+
+class Command(BaseCommand):
+    help = 'Import likes from a user_preferences.json file into the UserPreference table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('preferences_file', nargs='?', default='./bigdata_app/data/user_preferences.json')
+
+    def handle(self, *args, **options):
+        count = import_json_preferences(options['preferences_file'])
+        self.stdout.write(f"Imported {count} new preferences from {options['preferences_file']}")
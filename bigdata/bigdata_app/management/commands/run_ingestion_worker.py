@@ -0,0 +1,41 @@
+import functools
+import time
+
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.function import insertDefaultData
+from bigdata_app.function.inference import backends
+from bigdata_app.function.instrumentation import metrics_snapshot
+from bigdata_app.function.jobs import claim_next_job, requeue_orphaned_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run the queued ingestion jobs (download, fetch images, tag, index) outside of the web process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no job is queued')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--backend', choices=list(backends), help='Inference backend used to tag the images')
+
+    def handle(self, *args, **options):
+        requeued = requeue_orphaned_jobs()
+        if requeued:
+            self.stdout.write(f'Resuming {requeued} interrupted job(s)')
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Running {job}')
+            status = run_job(job, functools.partial(insertDefaultData, backend=options['backend']))
+            self.stdout.write(f'Job #{job.pk} {status}')
+
+            # Time spent in each ingestion step by this worker so far
+            histograms, counters = metrics_snapshot()
+            for name, histogram in sorted(histograms.items()):
+                if name.startswith('ingestion.'):
+                    self.stdout.write(f"  {name}: {histogram['count']} call(s), {histogram['sum'] / 1000:.1f}s")
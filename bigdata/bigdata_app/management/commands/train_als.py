@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bigdata_app.function.als import als_file, train_and_save
+from bigdata_app.function.interactions import get_interaction_matrix
+
+
+class Command(BaseCommand):
+    help = 'Train the implicit ALS factors of the users and images on the like matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factors', type=int, default=64)
+        parser.add_argument('--regularization', type=float, default=0.1)
+        parser.add_argument('--alpha', type=float, default=40.0, help='Confidence added to every like')
+        parser.add_argument('--iterations', type=int, default=15)
+        parser.add_argument('--output', default=als_file)
+
+    def handle(self, *args, **options):
+        train_and_save(get_interaction_matrix(), options['output'], options['factors'], options['regularization'],
+                       options['alpha'], options['iterations'])
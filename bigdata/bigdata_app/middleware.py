@@ -0,0 +1,66 @@
+import cProfile
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+
+from .function.instrumentation import observe, start_request, finish_request
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    # Times every request, sends the recommender stages in a Server-Timing header and logs
+    # the slow requests. A sample of the requests can be profiled with cProfile and tracemalloc:
+    # RECOMMENDER_PROFILE_SAMPLE_RATE sets the share of profiled requests, and the profiles
+    # of those slower than RECOMMENDER_SLOW_REQUEST_MS are written to RECOMMENDER_PROFILE_DIR.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'RECOMMENDER_SLOW_REQUEST_MS', 500)
+        self.sample_rate = getattr(settings, 'RECOMMENDER_PROFILE_SAMPLE_RATE', 0)
+        self.profile_dir = getattr(settings, 'RECOMMENDER_PROFILE_DIR', './bigdata_app/data/profiles/')
+
+    def __call__(self, request):
+        token = start_request()
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+            tracing = not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profiler is not None:
+                profiler.disable()
+                snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+                if tracing:
+                    tracemalloc.stop()
+            timings = finish_request(token)
+
+        observe('request', elapsed_ms)
+        stages = [f'{name};dur={total:.2f}' for name, (total, count) in timings.items()]
+        response['Server-Timing'] = ', '.join(stages + [f'total;dur={elapsed_ms:.2f}'])
+
+        if self.slow_ms is not None and elapsed_ms >= self.slow_ms:
+            logger.warning('Slow request %s %s: %.0fms (%s)', request.method, request.path, elapsed_ms,
+                           ', '.join(f'{name}={total:.1f}ms' for name, (total, count) in timings.items()))
+            if profiler is not None:
+                self.dump_profile(request, elapsed_ms, profiler, snapshot)
+        return response
+
+    def dump_profile(self, request, elapsed_ms, profiler, snapshot):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.path.strip('/').replace('/', '_') or 'root'}-{elapsed_ms:.0f}ms")
+        profiler.dump_stats(name + '.prof')
+        if snapshot is not None:
+            snapshot.dump(name + '.tracemalloc')
+        logger.warning('Profile of %s written to %s.prof', request.path, name)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('photo_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('photo_url', models.TextField()),
+                ('photo_image_url', models.TextField()),
+                ('photo_width', models.IntegerField(null=True)),
+                ('photo_height', models.IntegerField(null=True)),
+                ('photo_aspect_ratio', models.FloatField(null=True)),
+                ('photo_description', models.TextField(blank=True)),
+                ('photographer_username', models.CharField(blank=True, max_length=255)),
+                ('photographer_first_name', models.CharField(blank=True, max_length=255)),
+                ('photographer_last_name', models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+    ]
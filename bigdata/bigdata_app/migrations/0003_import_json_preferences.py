@@ -0,0 +1,33 @@
+import json
+import os
+
+from django.conf import settings
+from django.db import migrations
+
+
+def import_json_preferences(apps, schema_editor):
+    # Move the likes of the former user_preferences.json into the UserPreference table
+    preferences_file = os.path.join(settings.BASE_DIR, 'bigdata_app', 'data', 'user_preferences.json')
+    if not os.path.exists(preferences_file):
+        return
+
+    with open(preferences_file, 'r') as f:
+        preferences = json.load(f)
+
+    UserPreference = apps.get_model('bigdata_app', 'UserPreference')
+    UserPreference.objects.bulk_create(
+        [UserPreference(user_id=p['user_id'], image_id=p['image_id']) for p in preferences],
+        batch_size=2000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bigdata_app', '0002_user_preference'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_json_preferences, migrations.RunPython.noop),
+    ]
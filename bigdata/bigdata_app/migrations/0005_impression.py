@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bigdata_app', '0004_ingestion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Impression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('image_id', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'image_id'), name='unique_user_image_impression')],
+            },
+        ),
+    ]
@@ -1,3 +1,86 @@
 from django.db import models
 
 # Create your models here.
+
+
+# Unsplash photo catalogue, loaded once from photos.tsv000
+class Photo(models.Model):
+    photo_id = models.CharField(max_length=32, primary_key=True)
+    photo_url = models.TextField()
+    photo_image_url = models.TextField()
+    photo_width = models.IntegerField(null=True)
+    photo_height = models.IntegerField(null=True)
+    photo_aspect_ratio = models.FloatField(null=True)
+    photo_description = models.TextField(blank=True)
+    photographer_username = models.CharField(max_length=255, blank=True)
+    photographer_first_name = models.CharField(max_length=255, blank=True)
+    photographer_last_name = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return self.photo_id
+
+
+# One row per like, replaces user_preferences.json
+class UserPreference(models.Model):
+    user_id = models.IntegerField()
+    image_id = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'image_id'], name='unique_user_image_preference'),
+        ]
+        indexes = [
+            models.Index(fields=['image_id'], name='preference_image_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} -> {self.image_id}'
+
+
+# One row per image shown to a user on the home page, so that it is not shown again
+class Impression(models.Model):
+    user_id = models.IntegerField()
+    image_id = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'image_id'], name='unique_user_image_impression'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} saw {self.image_id}'
+
+
+# Background ingestion run, executed by the run_ingestion_worker command
+class IngestionJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)]
+    ACTIVE = (QUEUED, RUNNING)
+
+    kind = models.CharField(max_length=32, default='ingestion')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    stage = models.CharField(max_length=32, blank=True)
+    progress = models.JSONField(default=dict)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    pid = models.IntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            # Single flight: at most one queued or running job of each kind
+            models.UniqueConstraint(fields=['kind'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='single_active_ingestion_job'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
@@ -1,3 +1,78 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import SimpleTestCase
+from PIL import Image
+from .function.downloader import download_urls
 
-# Create your tests here.
+
+def _jpeg(size=(120, 80)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # /ok.jpg is an image, /flaky.jpg answers 503 twice before the image, /missing.jpg is a 404
+    image = _jpeg()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+        if self.path == '/ok.jpg' or (self.path == '/flaky.jpg' and hits > 2):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(self.image)))
+            self.end_headers()
+            self.wfile.write(self.image)
+        else:
+            self.send_response(503 if self.path == '/flaky.jpg' else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadUrlsTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.hits = {}
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def download(self, names, **kwargs):
+        jobs = [(f'{self.base_url}/{name}', os.path.join(self.output_dir, name)) for name in names]
+        return download_urls(jobs, concurrency=2, retries=3, backoff=0.01, **kwargs)
+
+    def test_retries_on_503(self):
+        self.assertEqual(self.download(['flaky.jpg']), (1, 0))
+        self.assertEqual(self.server.hits['/flaky.jpg'], 3)
+        with open(os.path.join(self.output_dir, 'flaky.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), StandInHandler.image)
+
+    def test_gives_up_on_404(self):
+        self.assertEqual(self.download(['missing.jpg', 'ok.jpg']), (1, 1))
+        self.assertEqual(self.server.hits['/missing.jpg'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'missing.jpg')))
+
+    def test_only_complete_images_are_visible(self):
+        self.download(['ok.jpg', 'flaky.jpg', 'missing.jpg'])
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['flaky.jpg', 'ok.jpg'])
+
+    def test_resize(self):
+        self.assertEqual(self.download(['ok.jpg'], resize=(32, 24)), (1, 0))
+        with Image.open(os.path.join(self.output_dir, 'ok.jpg')) as img:
+            self.assertEqual(img.size, (32, 24))
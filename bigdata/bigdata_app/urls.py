@@ -9,4 +9,9 @@ urlpatterns = [
     path("login", views.login_view, name="login"),
     path("logout", views.logout_view, name="logout"),
     path("dataset", views.dataset_view, name="dataset"),
+    path("dataset/status", views.dataset_status_view, name="dataset_status"),
+    path("dataset/cancel", views.dataset_cancel_view, name="dataset_cancel"),
+    path("metrics", views.metrics_view, name="metrics"),
+    path("api/recommendations", views.api_recommendations_view, name="api_recommendations"),
+    path("thumbnails/<str:size>/<str:name>", views.thumbnail_view, name="thumbnail"),
 ]
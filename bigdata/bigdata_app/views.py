@@ -1,5 +1,3 @@
-import threading
-
 from django.shortcuts import render
 
 # Create your views here.
@@ -11,62 +9,102 @@ from django.urls import reverse
 from django.contrib.auth import authenticate, logout, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.staticfiles.storage import staticfiles_storage
-import random
 import os
-import csv
-from .function.function import *
+import hmac
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
+from django.http import FileResponse, Http404
+from .function.recommenders import *
+from .function.preferences import add_user_preference, has_preferences
+from .function.photos import get_image_url, get_image_urls
+from .function.recommendation_cache import next_recommendation, queue_size
+from .function.batch_recommendations import get_precomputed_recommendations
+from .function.instrumentation import render_metrics
+from .function.seen import record_impression
+from .function.thumbnails import get_thumbnail, source_path, thumbnail_sizes, thumbnail_formats
+from .function.bulk import bulk_recommendations, bulk_algorithms, max_users
+from .function.jobs import enqueue_ingestion_job, get_active_job, get_latest_job, job_status, request_cancel
 
 
 def getImageUrl(imageName):
-    img = imageName.split(".")[0]
+    # O(1) lookup in the photo index instead of scanning photos.tsv000
+    return get_image_url(imageName)
 
-    with open("./bigdata_app/data/unsplash-research-dataset-lite-latest/photos.tsv000", "r", encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter="\t")
-        for i, row in enumerate(reader):
-            if img == row[0]:
-                url = row[2]
-                break
 
-    return url
+def recommendation_queue(user_id):
+    # Ranked candidates of the user from the last batch run, else computed now,
+    # with a fallback for the users without likes
+    names_recommended = get_precomputed_recommendations(user_id)
+    if names_recommended:
+        names_recommended = unseen_images(user_id, names_recommended)
+    if not names_recommended:
+        names_recommended = hybrid_recommendation(user_id, n=queue_size)
+    if(len(names_recommended) == 0):
+        names_recommended = collaborative_filtering_recommendation(user_id)
+    if(len(names_recommended) == 0):
+        names_recommended = random_images(queue_size, user_id=user_id)
+    return names_recommended
 
 
 def accueil_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
 
-    if not os.path.exists("./bigdata_app/data/user_preferences.json"):
+    if request.method == 'POST':
+        if request.POST.get('like') == '1' and request.POST.get('image'):
+            add_user_preference(request.user.id, request.POST.get('image'))
+
+    if not has_preferences():
         status = 0
         url_image = None
         name_image= None
     else:
         status = 1
-        names_recommended = hybrid_recommendation(request.user.id)
-        print(names_recommended)
-        if(len(names_recommended) == 0):
-            names_recommended = collaborative_filtering_recommendation(request.user.id)
-        name_image = names_recommended[random.randint(0, len(names_recommended)-1)]
-        url_image = getImageUrl(name_image)
-
-    if request.method == 'POST':
-        if request.POST.get('like') == '1':
-            add_user_preference(request.user.id, name_image)
+        # Served from the per-user cache, recomputed only when the queue is empty or after a like
+        name_image = next_recommendation(request.user.id, lambda: recommendation_queue(request.user.id))
+        if name_image and source_path(name_image):
+            # Resized copy of the downloaded image, served by this site
+            url_image = reverse('thumbnail', args=['medium', name_image])
+        else:
+            url_image = getImageUrl(name_image) if name_image else None
+        if name_image:
+            # The image will not be recommended to this user again
+            record_impression(request.user.id, name_image)
 
-    context = {'status': status, 'url_image': url_image}
+    context = {'status': status, 'url_image': url_image, 'name_image': name_image}
     return render(request, 'accueil.html', context)
 
 
-def download_all_data_async():
-    t = threading.Thread(target=insertDefaultData)
-    t.start()
-
 def dataset_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
-    if not os.path.exists("./bigdata_app/data/user_preferences.json"):
-        download_all_data_async()
+    if not has_preferences():
+        # The ingestion runs in the run_ingestion_worker process, never in the web workers
+        enqueue_ingestion_job()
     return redirect('accueil')
 
 
+def dataset_status_view(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+    return JsonResponse(job_status(get_latest_job()))
+
+
+def dataset_cancel_view(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    job = get_active_job()
+    cancelled = job is not None and request_cancel(job.pk)
+    return JsonResponse({'cancelled': cancelled})
+
+
 def login_view(request):
     statusLog = None
     stringMessageLog = ""
@@ -97,3 +135,123 @@ def logout_view(request):
         logout(request)
         return redirect('login')
 
+
+def _bearer_token_matches(request, token):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[len('Bearer '):], token)
+
+
+def metrics_view(request):
+    # Stage histograms and counters of this process, for the staff, a scraper sending the METRICS_TOKEN
+    # setting as a bearer token, or the addresses listed in METRICS_ALLOWED_IPS. Behind a reverse proxy
+    # every request comes from the proxy, so the peer address alone is only trusted when listed
+    allowed = (request.user.is_staff
+               or _bearer_token_matches(request, getattr(settings, 'METRICS_TOKEN', None))
+               or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ()))
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4')
+
+
+def _api_scope(request):
+    # Other services send the RECOMMENDATIONS_API_TOKEN setting as a bearer token and may ask for any user,
+    # as may the staff; other logged in users only get their own recommendations
+    if _bearer_token_matches(request, getattr(settings, 'RECOMMENDATIONS_API_TOKEN', None)):
+        return 'all'
+    if not request.user.is_authenticated:
+        return None
+    return 'all' if request.user.is_staff else request.user.id
+
+
+bulk_api_usage = (f'Expected a JSON object with a list of 1 to {max_users} integer user_ids, an integer n '
+                  f'between 1 and {queue_size} and an algorithm among {", ".join(bulk_algorithms)}')
+
+
+def _integer(value):
+    # Integers and strings of digits, as sent by a POST or a GET; bools are not ids
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
+def _parse_bulk_request(payload):
+    # (user_ids, n, algorithm) of a request, ValueError for anything else
+    if not isinstance(payload, dict) or not isinstance(payload.get('user_ids'), list):
+        raise ValueError(payload)
+    user_ids = [_integer(user_id) for user_id in payload['user_ids']]
+    n = _integer(payload.get('n', 10))
+    algorithm = payload.get('algorithm', 'hybrid')
+    if not user_ids or len(user_ids) > max_users or not 1 <= n <= queue_size or algorithm not in bulk_algorithms:
+        raise ValueError(payload)
+    return user_ids, n, algorithm
+
+
+def _bulk_response(user_ids, n, algorithm):
+    # Recommendations and image URLs of every requested user, resolved with one query
+    results = bulk_recommendations(list(dict.fromkeys(user_ids)), n, algorithm)
+    urls = get_image_urls({name for recommendations in results.values() for name, _ in recommendations})
+    return {
+        'algorithm': algorithm,
+        'n': n,
+        'results': {str(user_id): [{'image': name, 'url': urls.get(name), 'score': round(score, 6)}
+                                   for name, score in recommendations]
+                    for user_id, recommendations in results.items()},
+    }
+
+
+@csrf_exempt
+async def api_recommendations_view(request):
+    # Read only endpoint: GET ?user_ids=1,2&n=10&algorithm=hybrid, or POST of the same fields as JSON
+    scope = await sync_to_async(_api_scope)(request)
+    if scope is None:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            payload = None
+    elif request.method == 'GET':
+        payload = {key: request.GET[key] for key in ('n', 'algorithm') if key in request.GET}
+        payload['user_ids'] = [user_id for user_id in request.GET.get('user_ids', '').split(',') if user_id]
+    else:
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+
+    # Only the fixed usage message goes back to the client, never the text of an exception
+    try:
+        user_ids, n, algorithm = _parse_bulk_request(payload)
+    except ValueError:
+        return JsonResponse({'error': bulk_api_usage}, status=400)
+    if scope != 'all' and set(user_ids) != {scope}:
+        return JsonResponse({'error': 'Only the recommendations of the logged in user are available'}, status=403)
+    return JsonResponse(await sync_to_async(_bulk_response)(user_ids, n, algorithm))
+
+
+def _thumbnail_format(request):
+    return 'webp' if 'image/webp' in request.META.get('HTTP_ACCEPT', '') else 'jpeg'
+
+
+def _thumbnail_etag(request, size, name):
+    # Derived from the source image, so that a 304 costs a single stat
+    source = source_path(name)
+    if source is None or size not in thumbnail_sizes:
+        return None
+    stat = os.stat(source)
+    return f'{size}-{_thumbnail_format(request)}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+@require_GET
+@cache_control(public=True, max_age=86400)
+@vary_on_headers('Accept')
+@condition(etag_func=_thumbnail_etag)
+def thumbnail_view(request, size, name):
+    # The cache headers are set outside of condition, so that a 304 carries them too
+    fmt = _thumbnail_format(request)
+    try:
+        path = get_thumbnail(name, size, fmt)
+        f = open(path, 'rb') if path is not None else None
+    except OSError:
+        f = None
+    if f is None:
+        raise Http404('No such image')
+    return FileResponse(f, content_type=thumbnail_formats[fmt][1])